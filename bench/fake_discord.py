@@ -0,0 +1,65 @@
+# bench/fake_discord.py
+"""Just enough of discord.py's message, channel and webhook objects to drive on_message."""
+import itertools
+
+_ids = itertools.count(10**17)
+
+
+class FakeAsset:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeUser:
+    def __init__(self, name="benchmark-user"):
+        self.id = next(_ids)
+        self.display_name = name
+        self.avatar = None
+        self.default_avatar = FakeAsset("https://cdn.discordapp.com/embed/avatars/0.png")
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(_ids)
+
+
+class FakeChannel:
+    def __init__(self, guild):
+        self.id = next(_ids)
+        self.guild = guild
+        self.category_id = None
+        self.parent_id = None
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+
+    async def delete_messages(self, messages):
+        for message in messages:
+            message.deleted = True
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.deleted = False
+
+    async def delete(self):
+        self.deleted = True
+
+
+class WebhookSink:
+    """Stands in for WebhookManager and keeps what would have been posted."""
+
+    def __init__(self):
+        self.sent = []
+
+    def load(self):
+        pass
+
+    async def send(self, channel, **kwargs):
+        self.sent.append((channel.id, kwargs))
@@ -0,0 +1,120 @@
+# bench/fixtures.py
+"""Synthetic map files and BBCode messages for the benchmark."""
+import random
+from urllib.parse import quote_plus
+
+# Sizes of a busy live world
+DEFAULT_VILLAGES = 60000
+DEFAULT_PLAYERS = 12000
+DEFAULT_ALLIES = 600
+
+SYLLABLES = ["ka", "ro", "mi", "dra", "gon", "vel", "tor", "an", "is", "ul", "bar", "the", "lo", "zen", "qu"]
+UNITS = ["spear", "sword", "axe", "archer", "spy", "light", "marcher", "heavy", "ram", "catapult", "knight", "snob"]
+BUILDINGS = ["main", "barracks", "stable", "garage", "snob", "smith", "place", "market", "wood", "stone", "iron", "farm", "storage", "wall"]
+COMMANDS = ["attack", "attack_small", "attack_medium", "attack_large", "support"]
+CHAT = [
+    "anyone online?",
+    "incoming on my main, can someone send support",
+    "noble train lands in 20 min",
+    "gg everyone",
+    "who is taking the barb near k55?",
+]
+
+
+def make_name(rng, min_parts=2, max_parts=4):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(min_parts, max_parts))).capitalize()
+
+
+class FixtureWorld:
+    """One generated world: the raw map files plus what the corpus can refer to."""
+
+    def __init__(self, villages=DEFAULT_VILLAGES, players=DEFAULT_PLAYERS, allies=DEFAULT_ALLIES, seed=1):
+        rng = random.Random(seed)
+        self.ally_tags = []
+        self.player_names = []
+        self.coords = []
+
+        ally_lines = []
+        for ally_id in range(1, allies + 1):
+            tag = f"{make_name(rng, 1, 2)[:5].upper()}{ally_id}"
+            name = f"{make_name(rng)} {make_name(rng, 1, 2)}"
+            self.ally_tags.append(tag)
+            ally_lines.append(f"{ally_id},{quote_plus(name)},{quote_plus(tag)},{rng.randint(1, 50)},"
+                              f"{rng.randint(1, 2000)},{rng.randint(0, 10**7)},{rng.randint(0, 10**7)},{ally_id}")
+
+        player_lines = []
+        for player_id in range(1, players + 1):
+            name = f"{make_name(rng)}{rng.randint(0, 999)}"
+            ally_id = rng.randint(0, allies) if allies else 0
+            self.player_names.append(name)
+            player_lines.append(f"{player_id},{quote_plus(name)},{ally_id},{rng.randint(1, 300)},"
+                                f"{rng.randint(0, 10**6)},{player_id}")
+
+        village_lines = []
+        seen = set()
+        village_id = 0
+        while village_id < villages:
+            # Villages cluster around the middle of the map, like a real world
+            x = min(999, max(0, int(rng.gauss(500, 80))))
+            y = min(999, max(0, int(rng.gauss(500, 80))))
+            if (x, y) in seen:
+                continue
+            seen.add((x, y))
+            village_id += 1
+            owner = rng.randint(0, players) if players else 0
+            self.coords.append((x, y))
+            village_lines.append(f"{village_id},{quote_plus(make_name(rng) + ' village')},{x},{y},{owner},"
+                                 f"{rng.randint(26, 13000)},{rng.choice([0] * 9 + [rng.randint(1, 8)])}")
+
+        self.files = {
+            "village": "\n".join(village_lines).encode("utf-8"),
+            "player": "\n".join(player_lines).encode("utf-8"),
+            "ally": "\n".join(ally_lines).encode("utf-8"),
+        }
+
+    def emojis(self):
+        """An application emoji catalog covering every unit, building and command."""
+        names = [f"unit_{unit}" for unit in UNITS] + [f"build_{building}" for building in BUILDINGS] + COMMANDS
+        return [{"id": str(10**18 + index), "name": name, "animated": False} for index, name in enumerate(names)]
+
+    def random_entity(self, rng):
+        kind = rng.random()
+        if kind < 0.45:
+            # Mostly real villages, some empty map fields
+            x, y = rng.choice(self.coords) if rng.random() < 0.9 else (rng.randint(0, 999), rng.randint(0, 999))
+            return f"[coord]{x}|{y}[/coord]"
+        if kind < 0.65:
+            return f"[player]{rng.choice(self.player_names)}[/player]"
+        if kind < 0.75:
+            return f"[ally]{rng.choice(self.ally_tags)}[/ally]"
+        if kind < 0.85:
+            return f"[unit]{rng.choice(UNITS)}[/unit]"
+        if kind < 0.92:
+            return f"[building]{rng.choice(BUILDINGS)}[/building]"
+        return f"[command]{rng.choice(COMMANDS)}[/command]"
+
+    def corpus(self, count, seed=2, chat_share=0.3, hot_share=0.5):
+        """
+        Generate count messages.
+
+        chat_share of them are plain chat without BBCode. hot_share of the
+        entities repeat from a small hot set, like a war channel posting the
+        same targets again and again.
+        """
+        rng = random.Random(seed)
+        hot = [self.random_entity(rng) for _ in range(50)]
+        messages = []
+        for _ in range(count):
+            if rng.random() < chat_share:
+                messages.append(rng.choice(CHAT))
+                continue
+            lines = []
+            for _ in range(rng.randint(1, 8)):
+                entities = [rng.choice(hot) if rng.random() < hot_share else self.random_entity(rng)
+                            for _ in range(rng.randint(1, 4))]
+                line = " ".join(entities)
+                if rng.random() < 0.2:
+                    line = f"[b]{line}[/b]"
+                lines.append(line)
+            messages.append("\n".join(lines))
+        return messages
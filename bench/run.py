@@ -0,0 +1,144 @@
+# bench/run.py
+"""
+Replay a corpus of messages through the bot's on_message pipeline, offline.
+
+    python -m bench.run --messages 2000 --concurrency 8
+
+Map files and the twhelp.app API are served by a local stand-in and Discord
+is replaced by in-memory fakes, so the numbers only measure the bot itself.
+Reports latency percentiles, throughput, HTTP calls per message and peak RSS.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import importlib
+
+from bench.fixtures import FixtureWorld, DEFAULT_VILLAGES, DEFAULT_PLAYERS, DEFAULT_ALLIES
+from bench.stub_server import StubServer
+from bench.fake_discord import FakeGuild, FakeChannel, FakeMessage, FakeUser, WebhookSink
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+def peak_rss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def load_corpus(path):
+    """One message per line; a literal \\n inside a line stands for a line break."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip()]
+
+
+async def replay(bot_module, messages, concurrency):
+    guild = FakeGuild()
+    channel = FakeChannel(guild)
+    author = FakeUser()
+    bot_module.config_store.set("guild", guild.id, "bench1", "bench")
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(content):
+        async with semaphore:
+            message = FakeMessage(content, author, channel)
+            started = time.perf_counter()
+            await bot_module.on_message(message)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(content) for content in messages))
+    # Reposts are queued by on_message; the run ends when all went out
+    await bot_module.outbound.join()
+    return latencies, time.perf_counter() - started
+
+
+async def run(args):
+    fixture_world = FixtureWorld(args.villages, args.players, args.allies, seed=args.seed)
+    messages = load_corpus(args.corpus) if args.corpus else fixture_world.corpus(args.messages, seed=args.seed + 1)
+    print(f"Fixtures: {args.villages} villages, {args.players} players, {args.allies} tribes; "
+          f"{len(messages)} messages")
+
+    server = StubServer(fixture_world)
+    await server.start()
+
+    # Imported only now, so the settings above are picked up at import time
+    bot_module = importlib.import_module("main")
+    servers = importlib.import_module("commands.servers")
+    world_data = importlib.import_module("commands.world_data")
+    http = importlib.import_module("utils.http")
+    render_cache = importlib.import_module("commands.render_cache").render_cache
+    metrics = importlib.import_module("utils.metrics").metrics
+
+    servers.TWHELP_API = f"{server.base_url}/api/v2"
+    world_data.MAP_URL = f"{server.base_url}/worlds/{{host}}/map/{{name}}.txt"
+    sink = WebhookSink()
+    bot_module.webhook_manager = sink
+    bot_module.outbound.webhook_manager = sink
+    bot_module.config_store.load()
+    # A fixed emoji catalog, so [unit]/[building]/[command] never reach for the Discord API
+    bot_module.emoji_manager.set_emojis(fixture_world.emojis())
+    bot_module.emoji_manager.fetched_at = time.time()
+
+    try:
+        if args.warm:
+            await world_data.world_data_store.warm([("bench1", "bench")])
+        requests_before = server.total_requests
+
+        latencies, elapsed = await replay(bot_module, messages, args.concurrency)
+
+        http_calls = server.total_requests - requests_before
+        latencies.sort()
+        to_ms = 1000
+        print(f"Latency: p50 {percentile(latencies, 0.50) * to_ms:.2f} ms, "
+              f"p99 {percentile(latencies, 0.99) * to_ms:.2f} ms, max {latencies[-1] * to_ms:.2f} ms")
+        print(f"Throughput: {len(messages) / elapsed:.1f} messages/s ({elapsed:.2f} s total, "
+              f"concurrency {args.concurrency})")
+        print(f"HTTP calls: {http_calls} ({http_calls / len(messages):.4f} per message) {dict(server.requests)}")
+        print(f"Map data downloaded: {server.bytes_sent / 2**20:.2f} MB")
+        print(f"Webhook posts: {len(sink.sent)}")
+        print(f"Render cache: {render_cache.stats()}")
+        for (stage,) in sorted(metrics.stages.series):
+            print(f"  stage {stage}: {metrics.stages.count(stage)} x {metrics.stages.mean(stage) * to_ms:.3f} ms")
+        print(f"Peak RSS: {peak_rss_mb(resource.RUSAGE_SELF):.1f} MB "
+              f"(parser processes: {peak_rss_mb(resource.RUSAGE_CHILDREN):.1f} MB)")
+    finally:
+        await http.http_client.close()
+        bot_module.config_store.close()
+        world_data.shutdown_parse_pool()
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the BBCode formatting pipeline.")
+    parser.add_argument("--messages", type=int, default=2000, help="number of generated messages")
+    parser.add_argument("--corpus", help="replay messages from this file instead, one per line")
+    parser.add_argument("--concurrency", type=int, default=1, help="messages handled at the same time")
+    parser.add_argument("--villages", type=int, default=DEFAULT_VILLAGES)
+    parser.add_argument("--players", type=int, default=DEFAULT_PLAYERS)
+    parser.add_argument("--allies", type=int, default=DEFAULT_ALLIES)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--warm", action="store_true", help="load the map files before timing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="twbb-bench-") as tmp_dir:
+        # Keep snapshots and settings away from the real ones
+        os.environ["SNAPSHOT_DIR"] = os.path.join(tmp_dir, "snapshots")
+        os.environ["CONFIG_DB"] = os.path.join(tmp_dir, "configs.db")
+        os.chdir(tmp_dir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench/stub_server.py
+"""Local aiohttp stand-in for the twhelp.app API and the worlds' /map/*.txt files."""
+import gzip
+import hashlib
+from collections import Counter
+from aiohttp import web
+
+
+class StubServer:
+    """
+    Serves one server with one world on 127.0.0.1 and counts every request.
+
+    Map files are served plain and gzipped, with an ETag, and answer 304 to
+    a matching If-None-Match, like the game servers do.
+    """
+
+    def __init__(self, fixture_world, server_code="bench", world="bench1"):
+        self.fixture_world = fixture_world
+        self.server_code = server_code
+        self.world = world
+        self.requests = Counter()  # route -> number of requests
+        self.runner = None
+        self.port = None
+        self.files = {f"{name}.txt": body for name, body in fixture_world.files.items()}
+        self.files.update({f"{name}.gz": gzip.compress(body, 6) for name, body in list(self.files.items())})
+        self.etags = {name: f'"{hashlib.md5(body).hexdigest()}"' for name, body in self.files.items()}
+        self.bytes_sent = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/v2/versions", self.servers)
+        app.router.add_get("/api/v2/versions/{code}/servers", self.worlds)
+        app.router.add_get("/worlds/{host}/map/{name}", self.map_file)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def servers(self, request):
+        self.requests["servers"] += 1
+        return web.json_response({"data": [
+            {"code": self.server_code, "name": "Benchmark", "host": "www.bench.invalid"},
+        ]})
+
+    async def worlds(self, request):
+        self.requests["worlds"] += 1
+        return web.json_response({"data": [{"key": self.world}]})
+
+    async def map_file(self, request):
+        name = request.match_info["name"]
+        self.requests[f"map/{name}"] += 1
+        body = self.files.get(name)
+        if body is None:
+            raise web.HTTPNotFound()
+        etag = self.etags[name]
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        self.bytes_sent += len(body)
+        content_type = "application/gzip" if name.endswith(".gz") else "text/plain"
+        return web.Response(body=body, content_type=content_type, headers={"ETag": etag})
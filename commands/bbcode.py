@@ -0,0 +1,396 @@
+# commands/bbcode.py
+import re
+import asyncio
+from commands.village import format_village
+from commands.player import format_player
+from commands.ally import format_ally
+from commands.icons import format_unit, format_building, format_command
+from commands.world_data import world_data_store
+from commands.render_cache import render_cache
+from commands.servers import server_catalog
+from utils.metrics import metrics
+
+# Formatting tags and the Discord markdown they turn into
+FORMAT_MARKERS = {"b": "**", "i": "_", "u": "__"}
+# Tags whose content is a single value looked up when rendering
+ENTITY_TAGS = ("coord", "player", "ally", "unit", "building", "command")
+# Entity tags resolved from a world map file
+MAP_FILE_BY_TAG = {"coord": "village", "player": "player", "ally": "ally"}
+# Map files joined into an entity's rendering: a [coord] shows the village's owner and tribe
+JOINED_MAP_FILES = {"coord": ("player", "ally")}
+
+# One pattern finds every supported opening or closing tag
+TAG_PATTERN = re.compile(r"\[(/?)(coord|player|ally|unit|building|command|b|i|u)\]")
+# Cheap pre-check: any opening tag at all
+OPENING_TAG_PATTERN = re.compile(r"\[(?:coord|player|ally|unit|building|command|b|i|u)\]")
+COORD_PATTERN = re.compile(r"(\d+)\|(\d+)")
+
+COMMAND_COLORS = {
+    "attack": 0xA9A9A9,  # Light Grey
+    "attack_small": 0x00FF00,  # Green
+    "attack_medium": 0xFFA500,  # Orange
+    "attack_large": 0xFF0000,  # Red
+    "support": 0x0000FF,  # Blue
+}
+MIXED_COMMANDS_COLOR = 0x808080  # Medium Grey
+DEFAULT_COLOR = 0x00FFFF  # Cyan
+
+# Discord limits: characters of an embed description, characters over all
+# embeds of one message, and embeds per message
+EMBED_DESCRIPTION_LIMIT = 4096
+MESSAGE_EMBEDS_LIMIT = 6000
+MAX_EMBEDS_PER_MESSAGE = 10
+# An embed with less room than this left in its message starts a new message
+MIN_EMBED_ROOM = 200
+
+
+class Entity:
+    """An entity tag such as [coord]500|500[/coord]."""
+
+    def __init__(self, tag, value, source):
+        self.tag = tag
+        self.value = value
+        self.source = source  # the tag exactly as written, used when it can't be rendered
+
+    @property
+    def key(self):
+        """Identify entities that render the same, e.g. [player]Bob[/player] and [player]bob [/player]."""
+        if self.tag == "coord":
+            x, y = COORD_PATTERN.fullmatch(self.value).groups()
+            return (self.tag, f"{int(x)}|{int(y)}")
+        return (self.tag, self.value.strip().lower())
+
+
+class Format:
+    """A [b], [i] or [u] span, or the document root when tag is None."""
+
+    def __init__(self, tag=None):
+        self.tag = tag
+        self.children = []
+
+
+class Document(Format):
+    """Parsed message together with what the scan found along the way."""
+
+    def __init__(self):
+        super().__init__()
+        self.tags = set()  # names of all tags found, empty when there is nothing to format
+        self.entities = []  # every entity tag in order, for resolve_entities
+
+
+def contains_bbcode(content):
+    """Tell in one scan whether a message may need formatting."""
+    return "[" in content and OPENING_TAG_PATTERN.search(content) is not None
+
+
+def parse_bbcode(content):
+    """Tokenize content in a single scan and build its tag tree."""
+    document = Document()
+    stack = [document]
+    pos = 0
+    text_start = 0
+
+    def add_text(end):
+        if end > text_start:
+            stack[-1].children.append(content[text_start:end])
+
+    while True:
+        match = TAG_PATTERN.search(content, pos)
+        if not match:
+            break
+        closing, tag = match.groups()
+        start, end = match.span()
+        pos = end
+
+        if tag in FORMAT_MARKERS:
+            open_tags = [node.tag for node in stack]
+            if not closing:
+                add_text(start)
+                node = Format(tag)
+                stack[-1].children.append(node)
+                stack.append(node)
+            elif tag in open_tags:
+                add_text(start)
+                # Closing an outer tag also closes anything still open inside it
+                while stack.pop().tag != tag:
+                    pass
+            else:
+                continue  # stray closing tag, keep it as text
+            document.tags.add(tag)
+            text_start = end
+            continue
+
+        if closing:
+            continue
+        closing_tag = f"[/{tag}]"
+        close = content.find(closing_tag, end)
+        if close == -1:
+            continue
+        value = content[end:close]
+        if "\n" in value or (tag == "coord" and not COORD_PATTERN.fullmatch(value)):
+            continue
+
+        add_text(start)
+        pos = text_start = close + len(closing_tag)
+        entity = Entity(tag, value, content[start:pos])
+        stack[-1].children.append(entity)
+        document.entities.append(entity)
+        document.tags.add(tag)
+
+    add_text(len(content))
+    return document
+
+
+def determine_embed_color(commands):
+    """Pick the embed color from the [command] names found in a message or one of its embeds."""
+    matching_commands = {command for command in commands if command in COMMAND_COLORS}
+    # > 1 command found
+    if len(matching_commands) > 1:
+        return MIXED_COMMANDS_COLOR
+    # 1 command found
+    if matching_commands:
+        return COMMAND_COLORS[matching_commands.pop()]
+    # no commands found
+    return DEFAULT_COLOR
+
+
+async def render_entity(entity, world, server_code, server_host, emoji_manager):
+    if entity.tag == "coord":
+        x, y = COORD_PATTERN.fullmatch(entity.value).groups()
+        return await format_village(x, y, world, server_code, server_host)
+    if entity.tag == "player":
+        return await format_player(entity.value, world, server_code, server_host)
+    if entity.tag == "ally":
+        return await format_ally(entity.value, world, server_code, server_host)
+    with metrics.time("emoji_lookup"):
+        if entity.tag == "unit":
+            return format_unit(entity.value, emoji_manager)
+        if entity.tag == "building":
+            return format_building(entity.value, emoji_manager)
+        if entity.tag == "command":
+            return format_command(entity.value, emoji_manager)
+    return entity.source
+
+
+def entity_dependencies(entity, table):
+    """Return the (table name, id)s a map entity was rendered from, [(name, None)] if it wasn't found."""
+    name = MAP_FILE_BY_TAG[entity.tag]
+    if entity.tag == "coord":
+        row = table.find_row(*entity.key[1].split("|"))
+    else:
+        row = table.find_row(entity.value)
+    if row is None:
+        return [(name, None)]
+    dependencies = [(name, table.columns["id"][row])]
+    if entity.tag == "coord":
+        # Renamed owners, tribe changes and new tags show up in the village too
+        record = table.record(row)
+        if record["owner"]:
+            dependencies.append(("player", record["owner"]))
+        if record["ally"]:
+            dependencies.append(("ally", record["ally"]))
+    return dependencies
+
+
+async def resolve_entities(document, world, server_code, emoji_manager):
+    """
+    Render every distinct entity of a document concurrently.
+
+    The map files the message needs are loaded first, together, so the
+    lookups themselves only hit the in-memory indexes. Fragments rendered
+    from map data are served from the render cache until the entities they
+    show change. Returns a dict of entity key -> rendered fragment.
+    """
+    unique = {}
+    for entity in document.entities:
+        unique.setdefault(entity.key, entity)
+
+    map_files = {MAP_FILE_BY_TAG[tag] for tag, _ in unique if tag in MAP_FILE_BY_TAG}
+    map_files.update(name for tag, _ in unique for name in JOINED_MAP_FILES.get(tag, ()))
+    # Links need the server's host: looked up once for the whole message
+    lookups = [world_data_store.get_table(world, server_code, name) for name in map_files]
+    if lookups:
+        lookups.append(server_catalog.get_host(server_code))
+    results = await asyncio.gather(*lookups)
+    server_host = results[-1] if results else None
+
+    world_data = world_data_store.get_world(world, server_code)
+    version = world_data.version
+    fragments = {}
+    cache_keys = {}
+    for key, entity in unique.items():
+        # Only cache lookups answered from loaded data, not "not found" after a failed download
+        if entity.tag in MAP_FILE_BY_TAG and world_data.tables.get(MAP_FILE_BY_TAG[entity.tag]) is not None:
+            cache_key = (server_code, world, *key)
+            fragment = render_cache.get(cache_key)
+            if fragment is not None:
+                fragments[key] = fragment
+                continue
+            cache_keys[key] = cache_key
+
+    missing = [key for key in unique if key not in fragments]
+    rendered = await asyncio.gather(
+        *(render_entity(unique[key], world, server_code, server_host, emoji_manager) for key in missing)
+    )
+    fragments.update(zip(missing, rendered))
+    # Data patched while rendering could make these fragments outdated already, and
+    # without the server list their links are empty; neither may outlive this message
+    if world_data.version == version and server_host:
+        for key, cache_key in cache_keys.items():
+            entity = unique[key]
+            table = world_data.tables[MAP_FILE_BY_TAG[entity.tag]]
+            render_cache.put(cache_key, fragments[key], entity_dependencies(entity, table))
+    return fragments
+
+
+def text_units(text):
+    """Split plain text into "text" and "newline" units."""
+    units = []
+    for index, line in enumerate(text.split("\n")):
+        if index:
+            units.append(("newline", "\n", None))
+        if line:
+            units.append(("text", line, None))
+    return units
+
+
+async def render_bbcode_units(document, world, server_code, emoji_manager):
+    """
+    Resolve a parsed document's entities, then render it as (kind, text, command) units.
+
+    kind is "text", "newline", "entity", "open" or "close" (a formatting
+    marker), and command the name of a [command] entity. Joined, the texts
+    are the Discord markdown; layout_embeds() cuts between units.
+    """
+    fragments = await resolve_entities(document, world, server_code, emoji_manager)
+    units = []
+
+    def render(node):
+        for child in node.children:
+            if isinstance(child, str):
+                units.extend(text_units(child))
+            elif isinstance(child, Entity):
+                command = child.value.strip().lower() if child.tag == "command" else None
+                units.append(("entity", fragments[child.key], command))
+            else:
+                marker = FORMAT_MARKERS[child.tag]
+                units.append(("open", marker, None))
+                render(child)
+                units.append(("close", marker, None))
+
+    render(document)
+    return units
+
+
+async def render_bbcode(document, world, server_code, emoji_manager):
+    """Resolve a parsed document's entities, then render it as Discord markdown in one pass."""
+    units = await render_bbcode_units(document, world, server_code, emoji_manager)
+    return "".join(text for _, text, _ in units)
+
+
+class EmbedChunk:
+    """The description of one embed being filled, and the [command] names it shows."""
+
+    def __init__(self, opening, limit):
+        self.parts = [opening]
+        self.length = len(opening)
+        self.limit = limit
+        self.commands = []
+        self.has_content = False
+
+
+def layout_embeds(units, title="", prefix=""):
+    """
+    Split rendered units into embed descriptions, and those into webhook messages.
+
+    Cuts fall between lines where possible, else between tags, and inside a
+    text only when it alone overflows an embed; formatting open at a cut is
+    closed and reopened around it. A message gets up to 10 embeds within
+    Discord's character limit over all of them, its first one titled; each
+    embed is colored by its own [command] tags.
+
+    Returns a list of messages, each a list of (description, color).
+    """
+    messages = []
+    markers = []  # formatting markers open at the current position
+    chunk = None
+
+    def start_chunk():
+        nonlocal chunk
+        used = len(title) + sum(len(description) for description, _ in messages[-1]) if messages else 0
+        if (not messages or len(messages[-1]) == MAX_EMBEDS_PER_MESSAGE
+                or MESSAGE_EMBEDS_LIMIT - used < MIN_EMBED_ROOM):
+            messages.append([])
+            used = len(title)
+        chunk = EmbedChunk("".join(markers), min(EMBED_DESCRIPTION_LIMIT, MESSAGE_EMBEDS_LIMIT - used))
+
+    def finish_chunk():
+        if chunk.has_content:
+            chunk.parts.append("".join(reversed(markers)))
+            messages[-1].append(("".join(chunk.parts), determine_embed_color(chunk.commands)))
+
+    def fits(more):
+        length = chunk.length
+        open_markers = list(markers)
+        for kind, text, _ in more:
+            length += len(text)
+            if kind == "open":
+                open_markers.append(text)
+            elif kind == "close":
+                open_markers.pop()
+        return length + sum(map(len, open_markers)) <= chunk.limit
+
+    def add(unit):
+        kind, text, command = unit
+        chunk.parts.append(text)
+        chunk.length += len(text)
+        if kind == "open":
+            markers.append(text)
+        elif kind == "close":
+            markers.pop()
+        elif kind != "newline":
+            chunk.has_content = True
+        if command:
+            chunk.commands.append(command)
+
+    def add_cut(unit):
+        # A single unit longer than an embed: cut it, at a space if there is one
+        kind, text, command = unit
+        while text:
+            room = max(1, chunk.limit - chunk.length - sum(map(len, markers)))
+            piece = text[:room]
+            if len(text) > room and piece.rfind(" ") > 0:
+                piece = piece[:piece.rfind(" ") + 1]
+            add((kind, piece, command))
+            text = text[len(piece):]
+            if text:
+                finish_chunk()
+                start_chunk()
+
+    lines = [[]]
+    for unit in text_units(prefix) + units:
+        lines[-1].append(unit)
+        if unit[0] == "newline":
+            lines.append([])
+
+    start_chunk()
+    for line in lines:
+        if not fits(line):
+            if chunk.has_content:
+                finish_chunk()
+                start_chunk()
+        if fits(line):
+            for unit in line:
+                add(unit)
+            continue
+        # The line alone is longer than an embed; cut it between its tags
+        for unit in line:
+            if not fits([unit]) and chunk.has_content:
+                finish_chunk()
+                start_chunk()
+            if fits([unit]):
+                add(unit)
+            else:
+                add_cut(unit)
+    finish_chunk()
+    return [message for message in messages if message]
@@ -1,44 +1,129 @@
 # commands/emojis.py
-
+import os
+import json
+import time
+import asyncio
 from utils.api import fetch_emojis
+from utils.metrics import metrics
+
+EMOJI_CACHE_FILE = "emoji_cache.json"
+# Bump when the layout of the cache file changes
+EMOJI_CACHE_VERSION = 1
+# Application emojis rarely change, so refresh them a few times a day
+EMOJI_REFRESH_INTERVAL = 6 * 3600
+# Failed refreshes are retried after 30s, doubling up to 30 minutes
+EMOJI_RETRY_MIN = 30
+EMOJI_RETRY_MAX = 1800
+
+
+def render_emoji(emoji):
+    prefix = "a" if emoji.get("animated") else ""
+    return f"<{prefix}:{emoji['name']}:{emoji['id']}>"
 
-# commands/emojis.py
 
 class EmojiManager:
-    def __init__(self, app_id, token):
+    """
+    Application emojis indexed by name, as ready-to-send strings.
+
+    The catalog is persisted to EMOJI_CACHE_FILE and refreshed in the
+    background; lookups never wait on the Discord API.
+    """
+
+    def __init__(self, app_id, token, cache_path=EMOJI_CACHE_FILE):
         self.app_id = app_id
         self.token = token
-        self.emojis = []
-
-    def load_emojis(self, force_reload=False):
-        """Fetch emojis using the API and load them into the manager."""
-        if not self.emojis or force_reload:
-            try:
-                self.emojis = fetch_emojis(self.app_id, self.token)
-
-                # Check if the emojis are dictionaries with 'name' and 'id'
-                for emoji in self.emojis:
-                    if not isinstance(emoji, dict) or 'name' not in emoji or 'id' not in emoji:
-                        raise ValueError("Invalid emoji format.")
-                    
-            except Exception as e:
-                print(f"Error fetching emojis: {e}")
-                self.emojis = []
-
-    def get_emoji_id(self, name):
-        """Find the ID of an emoji by its name."""
+        self.cache_path = cache_path
+        self.emojis = {}  # name -> "<:name:id>"
+        self.fetched_at = 0
+        self.failures = 0
+        self.retry_at = 0
+        self.refresh_task = None
+
+    def set_emojis(self, emojis):
+        # Check if the emojis are dictionaries with 'name' and 'id'
+        for emoji in emojis:
+            if not isinstance(emoji, dict) or 'name' not in emoji or 'id' not in emoji:
+                raise ValueError("Invalid emoji format.")
+        self.emojis = {emoji['name']: render_emoji(emoji) for emoji in emojis}
+
+    def load_cache(self):
+        """Load the catalog saved by a previous run, if it belongs to this app."""
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") != EMOJI_CACHE_VERSION or cache.get("app_id") != str(self.app_id):
+                return False
+            self.set_emojis(cache["emojis"])
+            self.fetched_at = cache["fetched_at"]
+            return True
+        except (IOError, ValueError, KeyError) as e:
+            print(f"Error loading emoji cache: {e}")
+            return False
+
+    def save_cache(self, emojis):
+        cache = {
+            "version": EMOJI_CACHE_VERSION,
+            "app_id": str(self.app_id),
+            "fetched_at": self.fetched_at,
+            "emojis": emojis,
+        }
+        try:
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except IOError as e:
+            print(f"Error saving emoji cache: {e}")
+
+    async def refresh(self):
+        """Fetch the catalog from Discord, backing off after failures."""
+        try:
+            with metrics.time("emoji_refresh"):
+                emojis = await fetch_emojis(self.app_id, self.token)
+            self.set_emojis(emojis)
+        except Exception as e:
+            self.failures += 1
+            delay = min(EMOJI_RETRY_MAX, EMOJI_RETRY_MIN * 2 ** (self.failures - 1))
+            self.retry_at = time.time() + delay
+            print(f"Error fetching emojis (retrying in {delay}s): {e}")
+            return False
+
+        self.failures = 0
+        self.fetched_at = time.time()
+        self.save_cache(emojis)
+        return True
+
+    async def load_emojis(self, force_reload=False):
+        """Load the cached catalog and refresh it from Discord if needed."""
         if not self.emojis:
-            self.load_emojis()
+            self.load_cache()
+        if not self.emojis or force_reload or self.is_stale():
+            await self.start_refresh()
+
+    def is_stale(self):
+        return time.time() - self.fetched_at >= EMOJI_REFRESH_INTERVAL
+
+    def start_refresh(self):
+        """Return the running refresh task, starting one if none is in flight."""
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.get_running_loop().create_task(self.refresh())
+        return self.refresh_task
 
-        for emoji in self.emojis:
-            if emoji['name'] == name:
-                return emoji['id']
-        return None
+    def ensure_fresh(self):
+        """Start a background refresh when the catalog is due and we aren't backing off."""
+        if not self.is_stale() or time.time() < self.retry_at:
+            return
+        try:
+            self.start_refresh()
+        except RuntimeError:
+            pass  # no event loop, the next lookup inside one will refresh
 
     def get_emoji_string(self, name):
-        """Create the string representation of an emoji for Discord messages."""
-        emoji_id = self.get_emoji_id(name)
-        if emoji_id:
-            return f"<:{name}:{emoji_id}>"
-        else:
-            return f"Emoji not found for {name}"  # Provide feedback if no emoji found
+        """Return the string representation of an emoji for Discord messages."""
+        self.ensure_fresh()
+        emoji = self.emojis.get(name)
+        if emoji:
+            return emoji
+        return f"Emoji not found for {name}"  # Provide feedback if no emoji found
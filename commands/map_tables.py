@@ -0,0 +1,355 @@
+# commands/map_tables.py
+import sys
+import asyncio
+import urllib.parse
+from array import array
+
+# Coordinates on every world run from 0|0 to 999|999
+GRID_SIZE = 1000
+
+# A refresh touching more than this share of the rows rebuilds the table instead of patching it
+REBUILD_CHANGED_SHARE = 0.5
+# ...as does one that would leave more than this share of the rows deleted
+REBUILD_REMOVED_SHARE = 0.25
+
+
+def decode_name(value):
+    """Decode a URL-encoded name from the public map files."""
+    return urllib.parse.unquote_plus(value).strip()
+
+
+def join_rows(keys, table):
+    """Map every id in keys to the row of table holding that entity, -1 where there is none."""
+    ids = table.columns["id"]
+    get = {ids[row]: row for row in table.live_rows()}.get
+    return array("i", [get(key, -1) for key in keys])
+
+
+class MapTable:
+    """
+    One parsed map file stored column by column.
+
+    Integer columns are array('i') when parsed from a download, or int32
+    memoryviews over a snapshot file; string columns are lists or lazy
+    snapshot string tables. Both behave like sequences indexed by row.
+
+    Between exports a table is patched in place: rows of deleted entities
+    stay behind as unindexed gaps listed in `removed`, and `revision`
+    counts the patches for anything derived from the table.
+    get_derived() builds and caches such derived structures.
+    """
+
+    NAME = None
+    # Source column of each integer / string field in the map file
+    INT_COLUMNS = {}
+    STRING_COLUMNS = {}
+    MIN_FIELDS = 0
+
+    def __init__(self, columns, strings):
+        self.columns = columns
+        self.strings = strings
+        self.size = len(columns["id"])
+        self.removed = set()
+        self.revision = 0
+        self.derived = {}  # name -> (revision it was built from, value)
+        self.deriving = {}  # (name, revision) -> in-flight build task
+        self.build_indexes()
+
+    @classmethod
+    def empty_columns(cls):
+        return {name: array("i") for name in cls.INT_COLUMNS}, {name: [] for name in cls.STRING_COLUMNS}
+
+    @classmethod
+    def parse_rows(cls, data):
+        """Parse complete lines of a map file into (columns, strings) without building indexes."""
+        columns, strings = cls.empty_columns()
+        for line in data.splitlines():
+            fields = line.split(",")
+            if len(fields) < cls.MIN_FIELDS:
+                continue
+            try:
+                values = [int(fields[index]) for index in cls.INT_COLUMNS.values()]
+            except ValueError:
+                continue
+            for column, value in zip(columns.values(), values):
+                column.append(value)
+            for name, index in cls.STRING_COLUMNS.items():
+                # Names such as "Barbarian village" repeat thousands of times
+                strings[name].append(sys.intern(decode_name(fields[index])))
+        return columns, strings
+
+    def build_indexes(self):
+        pass
+
+    async def get_derived(self, name, build):
+        """
+        Return a structure derived from the table, such as a search index.
+
+        build(table) runs in a thread on first use and again after every
+        patch; callers arriving while it runs share the same build.
+        """
+        # Taken before the rows are read: a patch landing mid-build leaves
+        # the result stamped as outdated, so the next caller rebuilds it
+        revision = self.revision
+        built = self.derived.get(name)
+        if built is not None and built[0] == revision:
+            return built[1]
+        key = (name, revision)
+        task = self.deriving.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(build, self))
+            self.deriving[key] = task
+            task.add_done_callback(lambda _: self.deriving.pop(key, None))
+        value = await asyncio.shield(task)
+        built = self.derived.get(name)
+        if built is None or built[0] < revision:
+            self.derived[name] = (revision, value)
+        return value
+
+    def index_row(self, row):
+        pass
+
+    def unindex_row(self, row):
+        pass
+
+    def live_rows(self):
+        if not self.removed:
+            return range(self.size)
+        return [row for row in range(self.size) if row not in self.removed]
+
+    @property
+    def writable(self):
+        return isinstance(self.columns["id"], array)
+
+    def writable_columns(self):
+        """Copy snapshot-backed columns into arrays and lists that can be patched."""
+        columns = {name: array("i", column.tobytes()) for name, column in self.columns.items()}
+        strings = {name: [column[row] for row in range(len(column))] for name, column in self.strings.items()}
+        return columns, strings
+
+    def row_values(self, row):
+        return (tuple(column[row] for column in self.columns.values())
+                + tuple(column[row] for column in self.strings.values()))
+
+    def diff(self, columns, strings):
+        """
+        Compare the table with a newer export, matching rows by id.
+
+        Returns (added, changed, removed): values of new rows, (row, values)
+        of rows that differ and the rows whose entity is gone. Returns None
+        when so much changed that building a new table is cheaper.
+        """
+        old_rows = {self.columns["id"][row]: row for row in self.live_rows()}
+        new_columns = [columns[name] for name in self.INT_COLUMNS] + [strings[name] for name in self.STRING_COLUMNS]
+        added = []
+        changed = []
+        for values in zip(*new_columns):
+            row = old_rows.pop(values[0], None)
+            if row is None:
+                added.append(values)
+            elif values != self.row_values(row):
+                changed.append((row, values))
+        removed = list(old_rows.values())
+
+        if (len(added) + len(changed) + len(removed) > self.size * REBUILD_CHANGED_SHARE
+                or len(self.removed) + len(removed) > self.size * REBUILD_REMOVED_SHARE):
+            return None
+        return added, changed, removed
+
+    def apply_changes(self, added, changed, removed):
+        """Patch the table and its indexes with the result of diff(); returns the affected ids."""
+        ids = self.columns["id"]
+        affected = []
+        for row in removed:
+            affected.append(ids[row])
+            self.unindex_row(row)
+            self.removed.add(row)
+        for row, values in changed:
+            affected.append(ids[row])
+            self.unindex_row(row)
+            self.set_row(row, values)
+            self.index_row(row)
+        for values in added:
+            row = self.size
+            for column, value in zip(self.all_columns(), values):
+                column.append(value)
+            self.size += 1
+            affected.append(ids[row])
+            self.index_row(row)
+        self.revision += 1
+        return affected
+
+    def all_columns(self):
+        return list(self.columns.values()) + list(self.strings.values())
+
+    def set_row(self, row, values):
+        for column, value in zip(self.all_columns(), values):
+            column[row] = value
+
+    def nbytes(self):
+        """Approximate memory held by the table's columns and indexes."""
+        size = sum(memoryview(column).nbytes for column in self.columns.values())
+        for column in self.strings.values():
+            if isinstance(column, list):
+                size += sys.getsizeof(column) + sum(sys.getsizeof(value) for value in column)
+            else:
+                # Memory-mapped snapshot, shared with other processes
+                size += column.offsets.nbytes + column.blob.nbytes
+        for index in ("grid", "rows_by_name", "rows_by_tag", "owner_rows", "ally_rows"):
+            value = getattr(self, index, None)
+            if isinstance(value, array):
+                size += memoryview(value).nbytes
+            elif value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+    def record(self, row):
+        """Return one row as a dict of all its fields."""
+        record = {name: column[row] for name, column in self.columns.items()}
+        record.update((name, column[row]) for name, column in self.strings.items())
+        return record
+
+
+class VillageTable(MapTable):
+    NAME = "village"
+    # id,name,x,y,player,points,bonus
+    INT_COLUMNS = {"id": 0, "x": 2, "y": 3, "owner": 4, "points": 5, "bonus": 6}
+    STRING_COLUMNS = {"name": 1}
+    MIN_FIELDS = 7
+
+    # Set by join(): the player table and the row in it of each village's owner
+    players = None
+    owner_rows = None
+
+    def build_indexes(self):
+        # Dense grid of row + 1 per coordinate (0 = no village): 4 MB per world
+        # whatever the village count, and a [coord] lookup is one array read
+        xs, ys = self.columns["x"], self.columns["y"]
+        grid = array("i", bytes(4 * GRID_SIZE * GRID_SIZE))
+        for row in range(self.size):
+            x, y = xs[row], ys[row]
+            if 0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE:
+                grid[y * GRID_SIZE + x] = row + 1
+        self.grid = grid
+
+    def cell(self, row):
+        x, y = self.columns["x"][row], self.columns["y"][row]
+        return y * GRID_SIZE + x if 0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE else None
+
+    def index_row(self, row):
+        cell = self.cell(row)
+        if cell is not None:
+            self.grid[cell] = row + 1
+
+    def unindex_row(self, row):
+        cell = self.cell(row)
+        if cell is not None and self.grid[cell] == row + 1:
+            self.grid[cell] = 0
+
+    def find_row(self, x, y):
+        x, y = int(x), int(y)
+        if not (0 <= x < GRID_SIZE and 0 <= y < GRID_SIZE):
+            return None
+        row = self.grid[y * GRID_SIZE + x] - 1
+        return row if row >= 0 else None
+
+    def lookup(self, x, y):
+        row = self.find_row(x, y)
+        return self.record(row) if row is not None else None
+
+    def join(self, players):
+        """Resolve every village's owner to its player row, so a lookup needs no search."""
+        self.players = players
+        self.owner_rows = join_rows(self.columns["owner"], players)
+
+    def record(self, row):
+        """Return one village with its owner's name and tribe, None for barbarians or unknown ones."""
+        record = super().record(row)
+        owner_row = self.owner_rows[row] if self.owner_rows is not None else -1
+        if owner_row >= 0:
+            record["owner_name"] = self.players.strings["name"][owner_row]
+            record["ally"], record["ally_tag"] = self.players.ally(owner_row)
+        else:
+            record["owner_name"] = None
+            record["ally"], record["ally_tag"] = 0, None
+        return record
+
+
+class PlayerTable(MapTable):
+    NAME = "player"
+    # id,name,ally,villages,points,rank
+    INT_COLUMNS = {"id": 0, "ally": 2, "villages": 3, "points": 4, "rank": 5}
+    STRING_COLUMNS = {"name": 1}
+    MIN_FIELDS = 6
+
+    # Set by join(): the ally table and the row in it of each player's tribe
+    allies = None
+    ally_rows = None
+
+    def build_indexes(self):
+        names = self.strings["name"]
+        self.rows_by_name = {names[row].lower(): row for row in range(self.size)}
+
+    def index_row(self, row):
+        self.rows_by_name[self.strings["name"][row].lower()] = row
+
+    def unindex_row(self, row):
+        key = self.strings["name"][row].lower()
+        if self.rows_by_name.get(key) == row:
+            del self.rows_by_name[key]
+
+    def find_row(self, name):
+        return self.rows_by_name.get(name.strip().lower())
+
+    def lookup(self, name):
+        row = self.find_row(name)
+        return self.record(row) if row is not None else None
+
+    def join(self, allies):
+        """Resolve every player's tribe to its ally row."""
+        self.allies = allies
+        self.ally_rows = join_rows(self.columns["ally"], allies)
+
+    def ally(self, row):
+        """Return (ally id, tag) of a player's tribe, (0, None) without one."""
+        ally_row = self.ally_rows[row] if self.ally_rows is not None else -1
+        if ally_row < 0:
+            return 0, None
+        return self.allies.columns["id"][ally_row], self.allies.strings["tag"][ally_row]
+
+
+class AllyTable(MapTable):
+    NAME = "ally"
+    # id,name,tag,members,villages,points,all_points,rank
+    INT_COLUMNS = {"id": 0, "members": 3, "villages": 4, "points": 5, "all_points": 6, "rank": 7}
+    STRING_COLUMNS = {"name": 1, "tag": 2}
+    MIN_FIELDS = 8
+
+    def build_indexes(self):
+        tags = self.strings["tag"]
+        self.rows_by_tag = {tags[row].lower(): row for row in range(self.size)}
+
+    def index_row(self, row):
+        self.rows_by_tag[self.strings["tag"][row].lower()] = row
+
+    def unindex_row(self, row):
+        key = self.strings["tag"][row].lower()
+        if self.rows_by_tag.get(key) == row:
+            del self.rows_by_tag[key]
+
+    def find_row(self, tag):
+        return self.rows_by_tag.get(tag.strip().lower())
+
+    def lookup(self, tag):
+        row = self.find_row(tag)
+        return self.record(row) if row is not None else None
+
+
+# Map file name -> table class
+MAP_TABLES = {table.NAME: table for table in (VillageTable, PlayerTable, AllyTable)}
+
+
+def parse_rows(name, body):
+    """Parse a batch of complete lines of a map file; top-level so a worker process can run it."""
+    return MAP_TABLES[name].parse_rows(body.decode("utf-8", errors="replace"))
+
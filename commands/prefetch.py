@@ -0,0 +1,76 @@
+# commands/prefetch.py
+import time
+import asyncio
+from commands.world_data import WORLD_DATA_TTL
+
+# Wait this long after the hourly export before fetching it, so the game has finished writing it
+PREFETCH_DELAY = 120
+# How often to check again when the export is late
+PREFETCH_RETRY = 300
+
+
+class PrefetchScheduler:
+    """
+    Keeps the map files of every configured world loaded ahead of time.
+
+    Worlds are loaded at startup and as soon as /choose adds one; after
+    that each world is revalidated shortly after its next hourly export, so
+    the first message after an export doesn't wait on the download.
+    """
+
+    def __init__(self, store, get_worlds):
+        self.store = store
+        self.get_worlds = get_worlds  # returns the configured (world, server_code) pairs
+        self.tasks = {}  # (world, server_code) -> task following its exports
+        self.sync_task = None
+
+    async def sync(self):
+        """Start following newly configured worlds, stop following dropped ones, and load the new ones."""
+        worlds = set(self.get_worlds())
+        for key in set(self.tasks) - worlds:
+            self.tasks.pop(key).cancel()
+        added = worlds - set(self.tasks)
+        for world, server_code in added:
+            self.tasks[world, server_code] = asyncio.create_task(self.follow_exports(world, server_code))
+        await self.store.warm(added)
+
+    def schedule_sync(self):
+        """Run sync() in the background, e.g. right after /choose changed the configuration."""
+        if self.sync_task is None or self.sync_task.done():
+            self.sync_task = asyncio.create_task(self.sync())
+        else:
+            # A sync is running; run another one after it to pick up this change too
+            previous = self.sync_task
+            self.sync_task = asyncio.create_task(self.sync_after(previous))
+
+    async def sync_after(self, previous):
+        await asyncio.gather(previous, return_exceptions=True)
+        await self.sync()
+
+    async def follow_exports(self, world, server_code):
+        world_data = self.store.get_world(world, server_code)
+        while True:
+            await asyncio.sleep(self.next_prefetch_delay(world_data))
+            try:
+                await self.store.prefetch(world, server_code, force=True)
+            except Exception as e:
+                print(f"Error prefetching {server_code} {world}: {e}")
+
+    @staticmethod
+    def next_prefetch_delay(world_data):
+        """Seconds until the export after the newest one we hold should be available."""
+        now = time.time()
+        last_export = world_data.last_export()
+        if last_export is None:
+            # Exports are hourly; without a Last-Modified, assume they land on the hour
+            next_export = now - now % WORLD_DATA_TTL + WORLD_DATA_TTL
+        else:
+            next_export = last_export + WORLD_DATA_TTL
+        delay = next_export + PREFETCH_DELAY - now
+        # Overdue: the export is late (or skipped), check back every few minutes
+        return delay if delay > 0 else PREFETCH_RETRY
+
+    def stop(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
@@ -0,0 +1,81 @@
+# commands/render_cache.py
+from collections import OrderedDict
+from utils.metrics import metrics
+
+# Rendered fragments kept across all worlds
+RENDER_CACHE_SIZE = 20000
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of rendered BBCode fragments.
+
+    Keys are (server_code, world, tag, normalized value). Every fragment
+    records the map entities it was rendered from as (table name, id), or
+    (table name, None) for a "not found" answer. When a world's tables are
+    patched only the fragments of the changed entities are dropped; when a
+    table is replaced wholesale the world's fragments all go.
+    """
+
+    def __init__(self, max_size=RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (fragment, dependencies)
+        self.dependents = {}  # (server_code, world, table name, id) -> keys rendered from it
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            metrics.cache_requests.inc("render", "miss")
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        metrics.cache_requests.inc("render", "hit")
+        return entry[0]
+
+    def put(self, key, fragment, dependencies=()):
+        self.discard(key)
+        server_code, world = key[0], key[1]
+        dependencies = [(server_code, world, name, entity_id) for name, entity_id in dependencies]
+        self.entries[key] = (fragment, dependencies)
+        for dependency in dependencies:
+            self.dependents.setdefault(dependency, set()).add(key)
+        if len(self.entries) > self.max_size:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for dependency in entry[1]:
+            keys = self.dependents.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[dependency]
+
+    def invalidate(self, server_code, world):
+        """Drop every fragment rendered from a world's data."""
+        stale = [key for key in self.entries if key[0] == server_code and key[1] == world]
+        for key in stale:
+            self.discard(key)
+
+    def invalidate_entities(self, server_code, world, name, ids):
+        """Drop the fragments of changed entities, and "not found" answers that may now be found."""
+        for entity_id in list(ids) + [None]:
+            for key in list(self.dependents.get((server_code, world, name, entity_id), ())):
+                self.discard(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+render_cache = RenderCache()
@@ -0,0 +1,133 @@
+# commands/search.py
+import heapq
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+from array import array
+from commands.world_data import world_data_store
+
+# Discord shows at most 25 autocomplete choices
+MAX_RESULTS = 25
+# Autocomplete must answer within 3 seconds, leave room for the round trip
+AUTOCOMPLETE_TIMEOUT = 2.0
+# Fuzzy matches sharing less than this share of trigrams are dropped
+MIN_FUZZY_SCORE = 0.3
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """
+    Prefix and fuzzy search over the names of one map table.
+
+    Keys are kept in a sorted array for prefix search with bisect, and in a
+    trigram -> rows map for typo-tolerant search; a table row can have
+    several keys (a tribe is found by tag and by name).
+    """
+
+    def __init__(self, entries, ranks):
+        entries = sorted((key.lower(), row) for key, row in entries if key)
+        self.keys = [key for key, _ in entries]
+        self.rows = array("i", (row for _, row in entries))
+        self.key_trigrams = [trigrams(key) for key in self.keys]
+        self.trigram_keys = defaultdict(list)  # trigram -> positions in self.keys
+        for position, key_trigrams in enumerate(self.key_trigrams):
+            for trigram in key_trigrams:
+                self.trigram_keys[trigram].append(position)
+        # Best ranked first, shown before anything is typed
+        self.rows_by_rank = sorted({row for _, row in entries}, key=lambda row: ranks[row] or float("inf"))
+
+    def prefix(self, query, limit=MAX_RESULTS):
+        rows = []
+        position = bisect_left(self.keys, query)
+        while position < len(self.keys) and self.keys[position].startswith(query) and len(rows) < limit:
+            if self.rows[position] not in rows:
+                rows.append(self.rows[position])
+            position += 1
+        return rows
+
+    def fuzzy(self, query, limit=MAX_RESULTS):
+        query_trigrams = trigrams(query)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in self.trigram_keys.get(trigram, ()):
+                shared[position] += 1
+
+        # Dice coefficient of the two trigram sets
+        scored = (
+            (2 * count / (len(query_trigrams) + len(self.key_trigrams[position])), position)
+            for position, count in shared.items()
+        )
+        rows = []
+        for score, position in heapq.nlargest(limit * 2, scored):
+            if score < MIN_FUZZY_SCORE:
+                break
+            if self.rows[position] not in rows:
+                rows.append(self.rows[position])
+        return rows[:limit]
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Return matching rows: prefix matches first, then the closest fuzzy matches."""
+        query = query.strip().lower()
+        if not query:
+            return self.rows_by_rank[:limit]
+        rows = self.prefix(query, limit)
+        if len(rows) < limit:
+            rows += [row for row in self.fuzzy(query, limit) if row not in rows][:limit - len(rows)]
+        return rows
+
+
+def build_index(table):
+    rows = table.live_rows()
+    names = table.strings["name"]
+    entries = [(names[row], row) for row in rows]
+    if "tag" in table.strings:
+        tags = table.strings["tag"]
+        entries += [(tags[row], row) for row in rows]
+    return NameIndex(entries, table.columns["rank"])
+
+
+async def best_match(world, server_code, name, query):
+    """
+    Return the name (tag for tribes) a lookup of query should use: query
+    itself if it exists, else the top search hit, so a typo still finds
+    someone. None if nothing matches.
+    """
+    table = await world_data_store.get_table(world, server_code, name)
+    if table is None or not query.strip():
+        return None
+    if table.lookup(query) is not None:
+        return query
+    index = await table.get_derived("names", build_index)
+    rows = index.search(query, 1)
+    if not rows:
+        return None
+    return table.strings["tag" if name == "ally" else "name"][rows[0]]
+
+
+async def search_names(world, server_code, name, query, limit=MAX_RESULTS):
+    """
+    Search a world's players ("player") or tribes ("ally") for autocomplete.
+
+    Returns a list of (label, value) pairs, or nothing if the data isn't
+    available within AUTOCOMPLETE_TIMEOUT.
+    """
+    async def search():
+        table = await world_data_store.get_table(world, server_code, name)
+        if table is None:
+            return []
+        index = await table.get_derived("names", build_index)
+        return [table.record(row) for row in index.search(query, limit)]
+
+    try:
+        # Shield the lookup so a slow first download isn't cancelled for everyone
+        records = await asyncio.wait_for(asyncio.shield(search()), AUTOCOMPLETE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return []
+
+    if name == "ally":
+        return [(f"{record['tag']} - {record['name']}"[:100], record['tag'][:100]) for record in records]
+    return [(f"{record['name']} ({record['points']} points)"[:100], record['name'][:100]) for record in records]
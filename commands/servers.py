@@ -1,11 +1,108 @@
 # commands/servers.py
-import requests
+import time
+import asyncio
+import aiohttp
+from utils.http import http_client
+from utils.metrics import metrics
 
-def fetch_servers():
-    response = requests.get("https://twhelp.app/api/v2/versions?limit=500")
-    return response.json()['data'] if response.status_code == 200 else []
+TWHELP_API = "https://twhelp.app/api/v2"
 
-def fetch_worlds(server_code):
-    url = f"https://twhelp.app/api/v2/versions/{server_code}/servers?limit=500&open=true"
-    response = requests.get(url)
-    return response.json()['data'] if response.status_code == 200 else []
+# Servers and open worlds change rarely, so an hour-old list is good enough
+CATALOG_TTL = 3600
+# After a failed refresh keep serving the stale list (or nothing) and retry this much later
+CATALOG_RETRY_AFTER = 60
+
+
+class ServerCatalog:
+    """
+    Cached twhelp.app server and world lists.
+
+    Expired entries are served as-is while a single background task refreshes
+    them, so only the very first lookup of an entry waits on the network.
+    """
+
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self.cache = {}  # key -> (data, fetched_at)
+        self.hosts = {}  # server code -> host, e.g. "pt" -> "www.tribalwars.com.pt"
+        self.refreshing = {}  # key -> in-flight refresh task
+        self.failed_at = {}  # key -> when fetching a never loaded entry last failed
+
+    async def get_servers(self):
+        return await self.get("servers", f"{TWHELP_API}/versions?limit=500")
+
+    async def get_worlds(self, server_code):
+        return await self.get(
+            f"worlds:{server_code}",
+            f"{TWHELP_API}/versions/{server_code}/servers?limit=500&open=true"
+        )
+
+    async def get_host(self, server_code):
+        """Return the host of a server, only waiting on the network if the list was never fetched."""
+        await self.get_servers()
+        return self.hosts.get(server_code)
+
+    async def get(self, key, url):
+        entry = self.cache.get(key)
+        if entry is None:
+            # Nothing to serve yet, so this caller has to wait for the data,
+            # unless the last attempt failed moments ago
+            failed_at = self.failed_at.get(key)
+            if failed_at is not None and time.monotonic() - failed_at < CATALOG_RETRY_AFTER:
+                return []
+            await asyncio.shield(self.refresh(key, url))
+            entry = self.cache.get(key)
+            return entry[0] if entry else []
+
+        data, fetched_at = entry
+        if time.monotonic() - fetched_at >= self.ttl:
+            self.refresh(key, url)
+        return data
+
+    def refresh(self, key, url):
+        """Start refreshing an entry unless a refresh is already running."""
+        task = self.refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.run_refresh(key, url))
+            self.refreshing[key] = task
+        return task
+
+    async def run_refresh(self, key, url):
+        try:
+            with metrics.time("catalog_fetch"):
+                data = await fetch_json_data(url)
+            if data is not None:
+                self.cache[key] = (data, time.monotonic())
+                self.failed_at.pop(key, None)
+                if key == "servers":
+                    self.hosts = {server['code']: server['host'] for server in data}
+            elif key in self.cache:
+                stale_data, _ = self.cache[key]
+                self.cache[key] = (stale_data, time.monotonic() - self.ttl + CATALOG_RETRY_AFTER)
+            else:
+                self.failed_at[key] = time.monotonic()
+        finally:
+            self.refreshing.pop(key, None)
+
+
+async def fetch_json_data(url):
+    """Return the 'data' list of a twhelp.app response, or None on failure."""
+    try:
+        response = await http_client.get(url)
+        if response.ok:
+            return response.json()['data']
+        print(f"Error fetching {url}: {response.status}")
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+        print(f"Error fetching {url}: {e}")
+    return None
+
+
+server_catalog = ServerCatalog()
+
+
+async def fetch_servers():
+    return await server_catalog.get_servers()
+
+
+async def fetch_worlds(server_code):
+    return await server_catalog.get_worlds(server_code)
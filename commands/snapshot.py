@@ -0,0 +1,196 @@
+# commands/snapshot.py
+import os
+import sys
+import json
+import mmap
+import glob
+import time
+import struct
+import asyncio
+from array import array
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from commands.map_tables import MAP_TABLES
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: processes can't coordinate downloads, each one fetches its own copy
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_MAGIC = b"TWSNAP01"
+# Bump when the layout below changes; older files are then ignored
+SNAPSHOT_VERSION = 1
+
+# File layout, every section starting on a 4-byte boundary:
+#   magic (8 bytes) | header length (uint32) | JSON header, padded
+#   one int32 array of `rows` items per integer column
+#   per string column: int32 offsets (rows + 1 items), then the UTF-8 blob
+_LENGTH = struct.Struct("<I")
+
+
+def _pad(length):
+    return -length % 4
+
+
+def snapshot_path(server_code, world, name, data_hour):
+    return os.path.join(SNAPSHOT_DIR, server_code, world, f"{name}-{data_hour}.snap")
+
+
+def data_hour_of(last_modified, fallback_time):
+    """Label a map file export by the UTC hour it was generated, e.g. 2024123114."""
+    try:
+        return parsedate_to_datetime(last_modified).strftime("%Y%m%d%H")
+    except (TypeError, ValueError):
+        return time.strftime("%Y%m%d%H", time.gmtime(fallback_time))
+
+
+class StringTable:
+    """Read-only list of strings decoded on access from a snapshot."""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return str(self.blob[self.offsets[row]:self.offsets[row + 1]], "utf-8")
+
+
+def write_snapshot(path, table, etag=None, last_modified=None):
+    """Write a table to path atomically, so readers never see a partial file."""
+    # Rows of deleted entities left behind by patching are dropped
+    rows = table.live_rows()
+    compact = len(rows) != table.size
+    sections = []
+    for name in table.INT_COLUMNS:
+        column = table.columns[name]
+        sections.append(array("i", (column[row] for row in rows) if compact else column).tobytes())
+    for name in table.STRING_COLUMNS:
+        offsets = array("i", [0])
+        blob = bytearray()
+        column = table.strings[name]
+        for row in rows:
+            blob += column[row].encode("utf-8")
+            offsets.append(len(blob))
+        sections.append(offsets.tobytes())
+        sections.append(bytes(blob) + b"\0" * _pad(len(blob)))
+
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "table": table.NAME,
+        "rows": len(rows),
+        "byteorder": sys.byteorder,
+        "blob_sizes": [len(section) for section in sections],
+        "saved_at": time.time(),
+        "etag": etag,
+        "last_modified": last_modified,
+    }).encode("utf-8")
+    header += b" " * _pad(len(SNAPSHOT_MAGIC) + _LENGTH.size + len(header))
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_LENGTH.pack(len(header)))
+        f.write(header)
+        for section in sections:
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path):
+    """
+    Memory-map a snapshot and return (table, header), or None if it is unusable.
+
+    The file is mapped read-only, so every process reading the same snapshot
+    shares its pages instead of holding a private copy.
+    """
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    view = memoryview(mapped)
+    try:
+        if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            return None
+        pos = len(SNAPSHOT_MAGIC)
+        (header_length,) = _LENGTH.unpack_from(view, pos)
+        pos += _LENGTH.size
+        header = json.loads(bytes(view[pos:pos + header_length]))
+        pos += header_length
+        if header["version"] != SNAPSHOT_VERSION or header["byteorder"] != sys.byteorder:
+            return None
+
+        table_class = MAP_TABLES[header["table"]]
+        blob_sizes = iter(header["blob_sizes"])
+
+        def take(size):
+            nonlocal pos
+            if pos + size > len(view):
+                raise ValueError("file is cut short")
+            section = view[pos:pos + size]
+            pos += size
+            return section
+
+        columns = {name: take(next(blob_sizes)).cast("i") for name in table_class.INT_COLUMNS}
+        strings = {}
+        for name in table_class.STRING_COLUMNS:
+            offsets = take(next(blob_sizes)).cast("i")
+            strings[name] = StringTable(offsets, take(next(blob_sizes)))
+        table = table_class(columns, strings)
+    except (KeyError, ValueError, TypeError, StopIteration, struct.error) as e:
+        print(f"Ignoring unreadable snapshot {path}: {e}")
+        return None
+
+    # Keep the mapping alive as long as the table's views are
+    table.mapping = mapped
+    return table, header
+
+
+def latest_snapshot(server_code, world, name):
+    """Return the path of the newest snapshot of a world's map file, if any."""
+    paths = glob.glob(snapshot_path(server_code, world, name, "*"))
+    return max(paths) if paths else None
+
+
+def remove_older_snapshots(server_code, world, name, keep_path):
+    for path in glob.glob(snapshot_path(server_code, world, name, "*")):
+        if path != keep_path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+@asynccontextmanager
+async def download_lock(server_code, world, name, poll_interval=0.2):
+    """
+    Hold an exclusive cross-process lock on one world's map file.
+
+    Worker processes sharing SNAPSHOT_DIR take it around a download, so the
+    others wait and then load the snapshot it leaves behind.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    path = os.path.join(SNAPSHOT_DIR, server_code, world, f"{name}.lock")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as lock_file:
+        # Poll instead of blocking so the event loop (and cancellation) keep working
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
@@ -0,0 +1,140 @@
+# commands/spatial.py
+import heapq
+from array import array
+from commands.map_tables import GRID_SIZE
+from commands.world_data import world_data_store
+
+# Side of the square buckets villages are grouped in: 50 x 50 buckets per world
+BUCKET_SIZE = 20
+BUCKETS_PER_SIDE = GRID_SIZE // BUCKET_SIZE
+# Villages listed by /near
+NEAR_LIMIT = 20
+
+
+class SpatialIndex:
+    """
+    Nearest-village and radius queries over the villages of one world.
+
+    Villages are sorted into grid buckets, and their coordinates, owners and
+    rows copied into flat arrays in bucket order: a query only reads the
+    contiguous slices of the few buckets its area overlaps.
+    """
+
+    def __init__(self, table):
+        xs, ys, owners = table.columns["x"], table.columns["y"], table.columns["owner"]
+        rows = [row for row in table.live_rows() if table.cell(row) is not None]
+        buckets = [self.bucket(xs[row], ys[row]) for row in rows]
+
+        # Counting sort by bucket; starts[b]:starts[b + 1] is bucket b's slice
+        counts = array("i", bytes(4 * (BUCKETS_PER_SIDE * BUCKETS_PER_SIDE + 1)))
+        for bucket in buckets:
+            counts[bucket + 1] += 1
+        for bucket in range(1, len(counts)):
+            counts[bucket] += counts[bucket - 1]
+        self.starts = array("i", counts)
+        order = array("i", bytes(4 * len(rows)))
+        for row, bucket in zip(rows, buckets):
+            order[counts[bucket]] = row
+            counts[bucket] += 1
+
+        self.rows = order
+        self.xs = array("i", (xs[row] for row in order))
+        self.ys = array("i", (ys[row] for row in order))
+        self.owners = array("i", (owners[row] for row in order))
+
+    @staticmethod
+    def bucket(x, y):
+        return (y // BUCKET_SIZE) * BUCKETS_PER_SIDE + x // BUCKET_SIZE
+
+    def scan(self, bucket_x, bucket_y, x, y, owners, found):
+        """Append (squared distance, row) of the matching villages of one bucket to found."""
+        bucket = bucket_y * BUCKETS_PER_SIDE + bucket_x
+        xs, ys, village_owners, rows = self.xs, self.ys, self.owners, self.rows
+        for i in range(self.starts[bucket], self.starts[bucket + 1]):
+            if owners is None or village_owners[i] in owners:
+                dx, dy = xs[i] - x, ys[i] - y
+                found.append((dx * dx + dy * dy, rows[i]))
+
+    def within(self, x, y, radius, owners=None):
+        """Return (squared distance, row) of every village within radius of x|y, closest first."""
+        found = []
+        first_x, last_x = max(0, (x - radius) // BUCKET_SIZE), min(BUCKETS_PER_SIDE - 1, (x + radius) // BUCKET_SIZE)
+        first_y, last_y = max(0, (y - radius) // BUCKET_SIZE), min(BUCKETS_PER_SIDE - 1, (y + radius) // BUCKET_SIZE)
+        for bucket_y in range(first_y, last_y + 1):
+            for bucket_x in range(first_x, last_x + 1):
+                self.scan(bucket_x, bucket_y, x, y, owners, found)
+        limit = radius * radius
+        return sorted(item for item in found if item[0] <= limit)
+
+    def nearest(self, x, y, count=1, owners=None):
+        """
+        Return (squared distance, row) of the count villages closest to x|y.
+
+        Buckets are searched in rings around the one holding x|y until no
+        farther ring can hold anything closer than what was found.
+        """
+        # Coordinates off the map start from the nearest edge bucket
+        center_x = min(max(x // BUCKET_SIZE, 0), BUCKETS_PER_SIDE - 1)
+        center_y = min(max(y // BUCKET_SIZE, 0), BUCKETS_PER_SIDE - 1)
+        found = []
+        for ring in range(BUCKETS_PER_SIDE):
+            for bucket_y in range(center_y - ring, center_y + ring + 1):
+                if not 0 <= bucket_y < BUCKETS_PER_SIDE:
+                    continue
+                edge = bucket_y in (center_y - ring, center_y + ring)
+                for bucket_x in (range(center_x - ring, center_x + ring + 1) if edge
+                                 else (center_x - ring, center_x + ring)):
+                    if 0 <= bucket_x < BUCKETS_PER_SIDE:
+                        self.scan(bucket_x, bucket_y, x, y, owners, found)
+            found = heapq.nsmallest(count, found)
+            # Anything beyond this ring is at least ring * BUCKET_SIZE fields away
+            if len(found) == count and found[-1][0] <= (ring * BUCKET_SIZE) ** 2:
+                break
+        return found
+
+
+async def tribe_members(world, server_code, tag):
+    """Return the ids of the players in the tribe with this tag, or None if there is no such tribe."""
+    allies = await world_data_store.get_table(world, server_code, "ally")
+    players = await world_data_store.get_table(world, server_code, "player")
+    if allies is None or players is None:
+        return None
+    row = allies.find_row(tag)
+    if row is None:
+        return None
+    ally_id = allies.columns["id"][row]
+    ids, player_allies = players.columns["id"], players.columns["ally"]
+    return {ids[row] for row in players.live_rows() if player_allies[row] == ally_id}
+
+
+async def find_near(x, y, world, server_code, radius=None, owners=None, limit=NEAR_LIMIT):
+    """
+    Find villages around x|y: every one within radius, or the limit closest without one.
+
+    owners restricts the search to villages of these player ids (0 = barbarian).
+    Returns (records with a "distance", total found) or None if the data isn't available.
+    """
+    villages = await world_data_store.get_table(world, server_code, "village")
+    if villages is None:
+        return None
+    index = await villages.get_derived("spatial", SpatialIndex)
+    if radius is None:
+        found = index.nearest(x, y, limit, owners)
+    else:
+        found = index.within(x, y, radius, owners)
+    records = []
+    for squared_distance, row in found[:limit]:
+        record = villages.record(row)
+        record["distance"] = squared_distance ** 0.5
+        records.append(record)
+    return records, len(found)
+
+
+async def nearest_village(x, y, world, server_code):
+    """Return the village closest to x|y, or None if the world has none."""
+    villages = await world_data_store.get_table(world, server_code, "village")
+    if villages is None:
+        return None
+    index = await villages.get_derived("spatial", SpatialIndex)
+    found = index.nearest(int(x), int(y))
+    return villages.record(found[0][1]) if found else None
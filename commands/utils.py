@@ -1,10 +1,8 @@
 #commands/utils.py
-from commands.servers import fetch_servers
 
-def get_final_url(type, entity_id, world, server_code):
-    server_info = fetch_servers()
-    server_host = next((server['host'] for server in server_info if server['code'] == server_code), None)
-    
+def get_final_url(type, entity_id, world, server_host):
+    # server_host comes from server_catalog.get_host(), resolved once per message;
+    # a snapshot can produce entity_id before the server list was ever loaded
     if not server_host:
         return ""
 
@@ -1,53 +1,56 @@
 # commands/village.py
-import re
-import aiohttp
-import urllib.parse
-from commands.servers import fetch_servers
+from commands.world_data import world_data_store
 from commands.utils import get_final_url
+from commands.spatial import nearest_village, find_near
 
 async def fetch_village_from_game(x, y, world, server_code):
-    server_info = fetch_servers()
-    server_host = next((server['host'] for server in server_info if server['code'] == server_code), None)
+    """
+    Look up a village by its coordinates in the world's cached village.txt index.
+    """
+    villages = await world_data_store.get_table(world, server_code, "village")
+    return villages.lookup(x, y) if villages else None
 
-    if server_host:
-        host = server_host.replace('www', str(world))
-        url = f"https://{host}/map/village.txt"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.text()
-                    # Process the data and find the village matching the coordinates
-                    for line in data.splitlines():
-                        # Split each line by commas
-                        village = line.split(",")
-                        # Ensure there are enough elements in the village data
-                        if len(village) >= 7 and f"{x}|{y}" == f"{village[2]}|{village[3]}":  # Assuming format [x|y]
-                           
-                            village_name = urllib.parse.unquote(village[1]) 
-                            village_name = village_name.replace("+", " ") 
-                            return {
-                                "id": village[0],
-                                "name": village_name,
-                                "points": village[5]
-                            }
-    return None
+def format_owner(village):
+    """
+    Format the owner and tribe of a village, e.g. " – Bob [TAG]".
+    """
+    if village["owner_name"] is None:
+        return " – Barbarian" if village["owner"] == 0 else ""
+    if village["ally_tag"]:
+        return f" – {village['owner_name']} [{village['ally_tag']}]"
+    return f" – {village['owner_name']}"
 
-async def process_village_bbcode(content, world, server_code):
-    coord_pattern = r"\[coord\](\d+)\|(\d+)\[/coord\]"
-    matches = re.findall(coord_pattern, content)
+async def format_village(x, y, world, server_code, server_host):
+    """
+    Format a [coord] tag as a link to the village.
+    """
+    village = await fetch_village_from_game(x, y, world, server_code)
+    if village:
+        village_id = village["id"]
+        village_name = village["name"]
+        points = village["points"]
+        village_url = get_final_url("village", village_id, world, server_host)
+        return f"[[{village_name}] ({points} points)]({village_url}){format_owner(village)}"
+    nearest = await nearest_village(x, y, world, server_code)
+    if nearest:
+        nearest_url = get_final_url("village", nearest["id"], world, server_host)
+        return f"({x}|{y}) not found, nearest: [{nearest['name']} ({nearest['x']}|{nearest['y']})]({nearest_url})"
+    return f"({x}|{y}) not found."
 
-    for match in matches:
-        x, y = match
-        # Fetch the village data, using both world and server_code
-        village = await fetch_village_from_game(x, y, world, server_code)
-        if village:
-            village_id = village["id"]
-            village_name = village["name"]
-            points = village["points"]
-            village_url= get_final_url("village", village_id, world, server_code)
-            formatted_village = f"[[{village_name}] ({points} points)]({village_url})"
-
-            content = content.replace(f"[coord]{x}|{y}[/coord]", formatted_village)
-        else:
-            content = content.replace(f"[coord]{x}|{y}[/coord]", f"({x}|{y}) not found.")
-    return content
\ No newline at end of file
+async def format_nearby(x, y, world, server_code, server_host, radius=None, owners=None):
+    """
+    Format the villages around x|y as a list of links, closest first.
+    """
+    found = await find_near(x, y, world, server_code, radius, owners)
+    if found is None:
+        return "Village data is not available right now. Please try again later."
+    records, total = found
+    if not records:
+        return f"No villages found within {radius} fields of {x}|{y}." if radius else "No villages found."
+    lines = []
+    for village in records:
+        village_url = get_final_url("village", village["id"], world, server_host)
+        lines.append(f"`{village['distance']:5.1f}` [{village['name']} ({village['x']}|{village['y']})]({village_url}) {village['points']} points{format_owner(village)}")
+    if total > len(records):
+        lines.append(f"...and {total - len(records)} more.")
+    return "\n".join(lines)
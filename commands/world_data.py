@@ -0,0 +1,463 @@
+# commands/world_data.py
+import os
+import zlib
+import time
+import asyncio
+import aiohttp
+import multiprocessing
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from commands.servers import server_catalog
+from commands.map_tables import MAP_TABLES, parse_rows
+from commands import snapshot
+from commands.render_cache import render_cache
+from utils.http import http_client
+from utils.metrics import metrics
+
+# The game regenerates its public map files once an hour
+WORLD_DATA_TTL = 3600
+
+# Point this at a local server to run against stand-in map files; the
+# gzipped export of the same file is at the same URL plus ".gz"
+MAP_URL = "https://{host}/map/{name}.txt"
+
+# Downloads are read in chunks and parsed in batches of whole lines, so only
+# a few batches of a map file are ever held in memory besides its table
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PARSE_BATCH_SIZE = 1024 * 1024
+PARSE_BATCHES_IN_FLIGHT = 2
+
+# Batches at least this big are parsed in a worker process, smaller ones in a thread
+PROCESS_POOL_THRESHOLD = 256 * 1024
+PROCESS_POOL_WORKERS = 2
+# Workers must not be forked from the bot: a fork copies its threads' locks
+# and open sockets mid-use. forkserver where the platform has it, else spawn
+PROCESS_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+parse_pool = None
+
+
+async def parse_map_rows(name, data):
+    """
+    Parse a batch of map file lines off the event loop.
+
+    Big batches go to a process pool so parsing doesn't hold the GIL while
+    heartbeats and other messages wait; the rows come back as compact
+    column arrays.
+    """
+    global parse_pool
+    loop = asyncio.get_running_loop()
+    if len(data) >= PROCESS_POOL_THRESHOLD:
+        if parse_pool is None:
+            parse_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context(PROCESS_POOL_START_METHOD)
+            )
+        pool = parse_pool
+        try:
+            return await loop.run_in_executor(pool, parse_rows, name, data)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool next time
+            if parse_pool is pool:
+                parse_pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+    return await loop.run_in_executor(None, parse_rows, name, data)
+
+
+def shutdown_parse_pool():
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=False, cancel_futures=True)
+        parse_pool = None
+
+
+async def get_world_host(world, server_code):
+    """Return the game host of a world, e.g. pt103.tribalwars.com.pt."""
+    server_host = await server_catalog.get_host(server_code)
+    if not server_host:
+        return None
+    return server_host.replace('www', str(world))
+
+
+# stream_table() result when a server has no .gz exports
+GZIP_MISSING = object()
+
+
+class MapFileReader:
+    """
+    Build a table from a map file while it downloads.
+
+    Chunks are gunzipped as they arrive, cut into batches of whole lines and
+    parsed in the background, at most PARSE_BATCHES_IN_FLIGHT at a time;
+    the parsed rows are appended to the columns in file order.
+    """
+
+    def __init__(self, name, compressed):
+        self.name = name
+        self.table_class = MAP_TABLES[name]
+        self.decompressor = zlib.decompressobj(wbits=31) if compressed else None
+        self.pending = bytearray()  # text not yet handed to the parser
+        self.batches = deque()  # parse tasks in file order
+        self.columns, self.strings = self.table_class.empty_columns()
+
+    async def feed(self, chunk):
+        if self.decompressor is not None:
+            chunk = self.decompressor.decompress(chunk)
+        self.pending += chunk
+        if len(self.pending) >= PARSE_BATCH_SIZE:
+            cut = self.pending.rfind(b"\n") + 1
+            if cut:
+                self.submit(bytes(self.pending[:cut]))
+                del self.pending[:cut]
+        while len(self.batches) > PARSE_BATCHES_IN_FLIGHT:
+            self.merge(await self.batches.popleft())
+
+    def submit(self, data):
+        self.batches.append(asyncio.ensure_future(parse_map_rows(self.name, data)))
+
+    def merge(self, rows):
+        columns, strings = rows
+        for name, column in columns.items():
+            self.columns[name].extend(column)
+        for name, column in strings.items():
+            self.strings[name].extend(column)
+
+    async def finish(self):
+        """Parse what is left; returns the file's (columns, strings)."""
+        if self.decompressor is not None:
+            self.pending += self.decompressor.flush()
+            if not self.decompressor.eof:
+                raise zlib.error("truncated gzip stream")
+        if self.pending:
+            self.submit(bytes(self.pending))
+            self.pending = bytearray()
+        while self.batches:
+            self.merge(await self.batches.popleft())
+        return self.columns, self.strings
+
+    def cancel(self):
+        for batch in self.batches:
+            batch.cancel()
+
+
+class WorldData:
+    """
+    Indexed copy of one world's map files, each loaded on first use.
+
+    Every downloaded file is also written as a memory-mapped snapshot, so a
+    restart (or another process) can serve lookups before downloading it again.
+    """
+
+    def __init__(self, world, server_code):
+        self.world = world
+        self.server_code = server_code
+        self.tables = {}
+        self.loaded_at = {}
+        self.validators = {}  # map file name -> (etag, last_modified)
+        self.snapshots = {}  # map file name -> (path, mtime) of the snapshot we hold
+        self.refreshing = {}  # map file name -> in-flight refresh task
+        self.loading = {}  # map file name -> snapshot load a cold lookup waits on
+        # Cleared if the game server doesn't offer the gzipped exports
+        self.gzip_available = True
+        # Bumped whenever a table is replaced or patched
+        self.version = 0
+
+    def is_fresh(self, name, ttl):
+        loaded_at = self.loaded_at.get(name)
+        return loaded_at is not None and time.monotonic() - loaded_at < ttl
+
+    async def get_table(self, name, ttl):
+        """
+        Return the table of a map file, loading it when missing.
+
+        An expired table is still returned while a background refresh
+        replaces it, so only the very first lookup waits on the network.
+        """
+        if self.is_fresh(name, ttl):
+            metrics.cache_requests.inc("map_table", "hit")
+            return self.tables[name]
+        metrics.cache_requests.inc("map_table", "miss")
+
+        if name not in self.tables:
+            # After a restart the snapshot answers right away, however old;
+            # the refresh below revalidates it in the background
+            loading = self.loading.get(name)
+            if loading is None:
+                loading = asyncio.ensure_future(self.load_snapshot(name))
+                self.loading[name] = loading
+                loading.add_done_callback(lambda _: self.loading.pop(name, None))
+            await asyncio.shield(loading)
+        task = self.refresh(name, ttl)
+        if name in self.tables:
+            return self.tables[name]
+        # Shielded: a caller giving up must not cancel the download for everyone else
+        await asyncio.shield(task)
+        # None if the download failed
+        return self.tables.get(name)
+
+    def refresh(self, name, ttl=0):
+        """
+        Refresh a map file unless it is younger than ttl; returns the task doing it.
+
+        Single flight: while a refresh of the file is running, every caller
+        shares it instead of starting another download. ttl=0 forces a
+        revalidation, which costs a 304 when the export hasn't changed.
+        """
+        task = self.refreshing.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self.run_refresh(name, ttl))
+            self.refreshing[name] = task
+            task.add_done_callback(lambda task: self.refresh_done(name, task))
+        return task
+
+    def refresh_done(self, name, task):
+        del self.refreshing[name]
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error refreshing {self.world} {name}: {task.exception()!r}")
+
+    async def run_refresh(self, name, ttl):
+        started = time.time()
+        # After a restart, or when another worker process already refreshed
+        # the file, the newest snapshot makes the data usable right away
+        await self.load_snapshot(name)
+        if self.is_fresh(name, ttl):
+            return
+
+        # Only one process downloads a given map file at a time
+        async with snapshot.download_lock(self.server_code, self.world, name):
+            await self.load_snapshot(name)
+            # A snapshot another process saved or revalidated while we waited
+            # is as current as a download, even for a forced refresh
+            if self.is_fresh(name, ttl) or self.revalidated_since(name, started):
+                return
+
+            with metrics.time("map_download"):
+                downloaded = await self.download(name)
+            if downloaded is None:
+                return  # keep serving the copy we have
+            rows, etag, last_modified = downloaded
+            if rows is not None:
+                with metrics.time("map_refresh"):
+                    table = await self.refresh_table(name, rows)
+                self.validators[name] = (etag, last_modified)
+                await asyncio.to_thread(self.save_snapshot, name, table)
+            else:
+                # A 304 means the copy we hold is still the current export
+                self.touch_snapshot(name)
+            self.loaded_at[name] = time.monotonic()
+
+    def revalidated_since(self, name, started):
+        """Tell whether the snapshot we hold was written or revalidated after started."""
+        held = self.snapshots.get(name)
+        return held is not None and held[1] >= started
+
+    def last_export(self):
+        """Return when the newest map file we hold was generated, as a timestamp, or None."""
+        times = []
+        for _, last_modified in self.validators.values():
+            try:
+                times.append(parsedate_to_datetime(last_modified).timestamp())
+            except (TypeError, ValueError):
+                pass
+        return max(times, default=None)
+
+    async def refresh_table(self, name, rows):
+        """
+        Bring a map file's table up to date with a new export.
+
+        The table we hold is compared with the export in a thread and only
+        the rows that changed are patched in on the event loop, so the hourly
+        refresh doesn't rebuild the indexes. A first load, or an export that
+        changed too much, builds a new table instead.
+        """
+        columns, strings = rows
+        table = self.tables.get(name)
+        if table is not None:
+            if not table.writable:
+                # Snapshot-backed columns are read-only; patching needs a private copy once
+                table.columns, table.strings = await asyncio.to_thread(table.writable_columns)
+                table.mapping = None
+            changes = await asyncio.to_thread(table.diff, columns, strings)
+            if changes is not None:
+                self.apply_changes(name, table, changes)
+                return table
+
+        table = await asyncio.to_thread(MAP_TABLES[name], columns, strings)
+        # The only work left on the event loop is swapping the table in
+        self.set_table(name, table)
+        return table
+
+    def apply_changes(self, name, table, changes):
+        ids = table.apply_changes(*changes)
+        self.entities_changed(name, ids)
+        print(f"Refreshed {self.world} {name}: {len(ids)} changed rows")
+
+    def swap_table(self, name, table, changes):
+        """Swap in a newer copy of a table, given its diff() against the one held."""
+        held_ids = self.tables[name].columns["id"]
+        added, changed, removed = changes
+        ids = [values[0] for values in added] + [held_ids[row] for row, _ in changed] + [held_ids[row] for row in removed]
+        self.tables[name] = table
+        self.entities_changed(name, ids)
+        print(f"Adopted snapshot of {self.world} {name}: {len(ids)} changed rows")
+
+    def entities_changed(self, name, ids):
+        self.version += 1
+        render_cache.invalidate_entities(self.server_code, self.world, name, ids)
+        self.join_tables(name)
+
+    def set_table(self, name, table):
+        self.tables[name] = table
+        self.version += 1
+        render_cache.invalidate(self.server_code, self.world)
+        self.join_tables(name)
+
+    def join_tables(self, name):
+        """
+        Link villages to their owners and players to their tribes by row.
+
+        Runs on the event loop right after a table changes, so a lookup never
+        sees a table without its joins; only the joins reading the changed
+        table are redone, at one dict lookup per row.
+        """
+        villages, players, allies = (self.tables.get(name) for name in ("village", "player", "ally"))
+        if name in ("player", "ally") and players is not None and allies is not None:
+            players.join(allies)
+        if name in ("village", "player") and villages is not None and players is not None:
+            villages.join(players)
+
+    async def load_snapshot(self, name):
+        """Adopt the newest snapshot on disk if it is newer than the copy we hold."""
+        path = snapshot.latest_snapshot(self.server_code, self.world, name)
+        if not path:
+            return
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        if (path, mtime) == self.snapshots.get(name):
+            return
+
+        # Mapping is cheap, but building the indexes is worth keeping off the loop
+        with metrics.time("snapshot_load"):
+            loaded = await asyncio.to_thread(snapshot.read_snapshot, path)
+        if loaded is None:
+            return
+        table, header = loaded
+        held = self.tables.get(name)
+        # Another process's newer snapshot usually differs by an hour of changes;
+        # keep the render cache for everything else instead of dropping the world's
+        changes = await asyncio.to_thread(held.diff, table.columns, table.strings) if held is not None else None
+        if changes is not None:
+            self.swap_table(name, table, changes)
+        else:
+            self.set_table(name, table)
+        self.validators[name] = (header["etag"], header["last_modified"])
+        self.snapshots[name] = (path, mtime)
+        # The file's age (refreshed on every 304) counts against the TTL
+        age = max(0.0, time.time() - mtime)
+        self.loaded_at[name] = time.monotonic() - age
+
+    def save_snapshot(self, name, table):
+        etag, last_modified = self.validators[name]
+        data_hour = snapshot.data_hour_of(last_modified, time.time())
+        path = snapshot.snapshot_path(self.server_code, self.world, name, data_hour)
+        try:
+            snapshot.write_snapshot(path, table, etag, last_modified)
+            snapshot.remove_older_snapshots(self.server_code, self.world, name, path)
+            self.snapshots[name] = (path, os.path.getmtime(path))
+        except OSError as e:
+            print(f"Error saving snapshot {path}: {e}")
+
+    def touch_snapshot(self, name):
+        """Mark our snapshot as revalidated, so other processes don't revalidate it again."""
+        if name not in self.snapshots:
+            return
+        path, _ = self.snapshots[name]
+        try:
+            os.utime(path)
+            self.snapshots[name] = (path, os.path.getmtime(path))
+        except OSError:
+            pass
+
+    async def download(self, name):
+        """
+        Fetch and parse a map file, revalidating the copy we already hold.
+
+        Returns (table, etag, last_modified), with table None when our copy
+        is still current, or None if the download failed.
+        """
+        host = await get_world_host(self.world, self.server_code)
+        if not host:
+            return None
+
+        url = MAP_URL.format(host=host, name=name)
+        if self.gzip_available:
+            downloaded = await self.stream_table(name, f"{url}.gz", compressed=True)
+            if downloaded is not GZIP_MISSING:
+                return downloaded
+            print(f"No gzipped map files for {self.world}, downloading plain text")
+            self.gzip_available = False
+        return await self.stream_table(name, url, compressed=False)
+
+    async def stream_table(self, name, url, compressed):
+        etag, last_modified = self.validators.get(name, (None, None))
+        reader = MapFileReader(name, compressed)
+        try:
+            async with http_client.stream(url, etag=etag, last_modified=last_modified) as response:
+                if response.status == 304:
+                    return None, etag, last_modified
+                if response.status == 404 and compressed:
+                    return GZIP_MISSING
+                if response.status != 200:
+                    print(f"Error fetching {url}: {response.status}")
+                    return None
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await reader.feed(chunk)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+            return await reader.finish(), etag, last_modified
+        except (aiohttp.ClientError, asyncio.TimeoutError, zlib.error) as e:
+            print(f"Error fetching {url}: {e}")
+            return None
+        finally:
+            reader.cancel()
+
+
+class WorldDataStore:
+    """Keeps one WorldData per (server, world) for the lifetime of the bot."""
+
+    def __init__(self, ttl=WORLD_DATA_TTL):
+        self.ttl = ttl
+        self.worlds = {}
+
+    def get_world(self, world, server_code):
+        key = (server_code, world)
+        if key not in self.worlds:
+            self.worlds[key] = WorldData(world, server_code)
+        return self.worlds[key]
+
+    async def get_table(self, world, server_code, name):
+        return await self.get_world(world, server_code).get_table(name, self.ttl)
+
+    def memory_usage(self):
+        """Yield ((server_code, world, table), approximate bytes) for every loaded table."""
+        for (server_code, world), world_data in self.worlds.items():
+            for name, table in world_data.tables.items():
+                yield (server_code, world, name), table.nbytes()
+
+    async def prefetch(self, world, server_code, force=False):
+        """Load or refresh every map file of a world; force revalidates even fresh files."""
+        world_data = self.get_world(world, server_code)
+        ttl = 0 if force else self.ttl
+        await asyncio.gather(*(world_data.refresh(name, ttl) for name in MAP_TABLES), return_exceptions=True)
+
+    async def warm(self, worlds):
+        """Load every map file of the given (world, server_code) pairs concurrently."""
+        await asyncio.gather(*(self.prefetch(world, server_code) for world, server_code in worlds))
+
+
+world_data_store = WorldDataStore()
+metrics.gauge("twbb_world_data_bytes", "Approximate memory of each loaded map table.",
+              ("server", "world", "table"), collect=world_data_store.memory_usage)
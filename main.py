@@ -1,69 +1,104 @@
 import os
-import json
+import time
+import asyncio
 import discord
 from discord.ext import commands
 from discord.ui import Select, View
 from discord import app_commands
 from discord import Embed
 from dotenv import load_dotenv
-from commands.village import process_village_bbcode
-from commands.player import process_player_bbcode
-from commands.ally import process_tribe_bbcode
-from commands.icons import process_unit_bbcode, process_building_bbcode, process_command_bbcode
-from commands.servers import fetch_servers, fetch_worlds
-from utils.api import fetch_emojis
+from commands.bbcode import contains_bbcode, parse_bbcode, render_bbcode_units, layout_embeds, COORD_PATTERN
+from commands.servers import fetch_servers, fetch_worlds, server_catalog
 from commands.emojis import EmojiManager
+from commands.world_data import world_data_store, shutdown_parse_pool
+from commands.prefetch import PrefetchScheduler
+from commands.player import format_player
+from commands.ally import format_ally
+from commands.village import format_nearby
+from commands.spatial import tribe_members
+from commands.search import search_names, best_match
+from utils.http import http_client
+from utils.webhooks import WebhookManager, WEBHOOKS_FILE
+from utils.outbound import OutboundScheduler
+from utils.config_store import ConfigStore
+from utils.startup import startup_timer, warm_caches
+from utils.metrics import metrics, METRICS_PORT, start_metrics_server, monitor_loop_lag, watch_discord_rate_limits
+from commands.render_cache import render_cache
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 APP_ID = os.getenv("APP_ID")
-if not TOKEN or not APP_ID:
-    raise ValueError("Token or Application ID not found! Make sure 'DISCORD_TOKEN' and 'APP_ID' are set in your .env file.")
+
+# Sharding, set by shard_supervisor.py for each worker process:
+# SHARD_COUNT is the total number of shards ("auto" lets Discord decide),
+# SHARD_IDS the comma-separated shards this process runs
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+SHARD_IDS = os.getenv("SHARD_IDS")
+
+# Slash commands only reach Discord when the command tree is synced, which is
+# rate-limited: set SYNC_COMMANDS=1 for one start after adding or changing them.
+# Commands are global, so only the process running shard 0 uploads them
+SYNC_COMMANDS = os.getenv("SYNC_COMMANDS") == "1" and (not SHARD_IDS or "0" in SHARD_IDS.split(","))
+
+def create_client(intents):
+    if not SHARD_COUNT:
+        return discord.Client(intents=intents)
+    if SHARD_COUNT == "auto":
+        return discord.AutoShardedClient(intents=intents)
+    shard_ids = [int(shard_id) for shard_id in SHARD_IDS.split(",")] if SHARD_IDS else None
+    return discord.AutoShardedClient(intents=intents, shard_count=int(SHARD_COUNT), shard_ids=shard_ids)
 
 # Discord Bot Setup
 intents = discord.Intents.default()
 intents.message_content = True
-bot = discord.Client(intents=intents)
+bot = create_client(intents)
 tree = app_commands.CommandTree(bot)
 
 emoji_manager = EmojiManager(APP_ID, TOKEN)
-emoji_manager.load_emojis()
 
-# Fetch app-specific emojis
-app_emojis = fetch_emojis(APP_ID, TOKEN)
+# Reusable per-channel webhooks for reposting formatted messages; each worker
+# process keeps its own file since its channels belong to its shards only
+webhook_manager = WebhookManager(bot, f"webhooks-{SHARD_IDS.replace(',', '-')}.json" if SHARD_IDS else WEBHOOKS_FILE)
 
-# Dictionary to store world configurations per channel
-channel_configs = {}
+# Per-channel ordered reposting and batched deletion of the originals
+outbound = OutboundScheduler(webhook_manager)
 
-def save_configs():
-    try:
-        with open("channel_configs.json", "w") as f:
-            json.dump(channel_configs, f)
-    except IOError as e:
-        print(f"Error saving configuration: {e}")
-
-def load_configs():
-    global channel_configs
-    if os.path.exists("channel_configs.json"):
-        if os.path.getsize("channel_configs.json") > 0:
-            try:
-                with open("channel_configs.json", "r") as f:
-                    channel_configs = json.load(f)
-            except json.JSONDecodeError:
-                channel_configs = {}
-        else:
-            channel_configs = {}
-    else:
-        channel_configs = {}
+# Background cache warm-up started by setup_hook
+warmup_task = None
+
+# Local Prometheus endpoint and event loop lag monitor, started by setup_hook;
+# each worker process of a sharded deployment listens on its own port
+metrics_port = METRICS_PORT + int(SHARD_IDS.split(",")[0]) if METRICS_PORT and SHARD_IDS else METRICS_PORT
+metrics_runner = None
+loop_lag_task = None
+
+# Server/world settings per channel, category and guild
+config_store = ConfigStore()
+# Keeps the configured worlds' map files loaded ahead of each hourly export
+prefetch_scheduler = PrefetchScheduler(world_data_store, config_store.worlds)
 
-# Load the saved configs on startup
-load_configs()
+# Unconfigured channels are reminded to run /choose at most once per cooldown
+UNCONFIGURED_NOTICE_COOLDOWN = 3600
+unconfigured_notices = {}  # channel id -> time of the last reminder
+
+def should_send_unconfigured_notice(channel_id):
+    now = time.monotonic()
+    last_notice = unconfigured_notices.get(channel_id)
+    if last_notice is not None and now - last_notice < UNCONFIGURED_NOTICE_COOLDOWN:
+        return False
+    unconfigured_notices[channel_id] = now
+    return True
+
+# Human-readable names of the places a setting can apply to
+SCOPE_LABELS = {"channel": "this channel", "category": "this category", "guild": "this Discord server"}
 
 class SelectServerWorld(View):
-    def __init__(self, server_data):
+    def __init__(self, server_data, scope="channel", scope_id=None):
         super().__init__()
         self.server_data = server_data
+        self.scope = scope
+        self.scope_id = scope_id
         self.selected_server = None
         self.add_item(self.create_server_select_menu())
 
@@ -76,7 +111,7 @@ class SelectServerWorld(View):
 
     async def on_server_select(self, interaction: discord.Interaction):
         self.selected_server = interaction.data['values'][0]
-        worlds = fetch_worlds(self.selected_server)
+        worlds = await fetch_worlds(self.selected_server)
         if not worlds:
             await interaction.response.send_message("No worlds found for this server.", ephemeral=True)
             return
@@ -90,36 +125,64 @@ class SelectServerWorld(View):
 
     async def on_world_select(self, interaction: discord.Interaction):
         selected_world = interaction.data['values'][0]
-        channel_id = str(interaction.channel.id)
-        channel_configs[channel_id] = {"world": selected_world, "server": self.selected_server}
-        save_configs()
-        await interaction.response.send_message(f"Server: {self.selected_server}, World: {selected_world} set for this channel.", ephemeral=True)
+        config_store.set(self.scope, self.scope_id, selected_world, self.selected_server)
+        # Channels covered by the new setting shouldn't be told they lack one
+        unconfigured_notices.clear()
+        # Load a newly chosen world now rather than on its first message
+        prefetch_scheduler.schedule_sync()
+        await interaction.response.send_message(
+            f"Server: {self.selected_server}, World: {selected_world} set for {SCOPE_LABELS[self.scope]}.",
+            ephemeral=True
+        )
 
 # Slash command to choose server and world
 @tree.command(name="choose", description="Select the server and world for this channel.")
-async def choose(interaction: discord.Interaction):
-    server_data = fetch_servers()
+@app_commands.describe(scope="Apply the setting to this channel (default), its whole category or the whole Discord server.")
+@app_commands.choices(scope=[
+    app_commands.Choice(name="This channel", value="channel"),
+    app_commands.Choice(name="This category", value="category"),
+    app_commands.Choice(name="Whole Discord server", value="guild"),
+])
+async def choose(interaction: discord.Interaction, scope: app_commands.Choice[str] = None):
+    scope = scope.value if scope else "channel"
+    if scope == "channel":
+        scope_id = interaction.channel.id
+    elif scope == "category":
+        scope_id = getattr(interaction.channel, "category_id", None)
+        if scope_id is None:
+            await interaction.response.send_message("This channel is not in a category.", ephemeral=True)
+            return
+        if not interaction.permissions.manage_channels:
+            await interaction.response.send_message("You need the Manage Channels permission to set a category default.", ephemeral=True)
+            return
+    else:
+        scope_id = interaction.guild_id
+        if scope_id is None:
+            await interaction.response.send_message("Server-wide defaults can only be set inside a Discord server.", ephemeral=True)
+            return
+        if not interaction.permissions.manage_guild:
+            await interaction.response.send_message("You need the Manage Server permission to set a server default.", ephemeral=True)
+            return
+
+    server_data = await fetch_servers()
     if not server_data:
         await interaction.response.send_message("No servers available. Please try again later.", ephemeral=True)
         return
 
-    view = SelectServerWorld(server_data)
+    view = SelectServerWorld(server_data, scope, scope_id)
     await interaction.response.send_message("Choose a server and world using the dropdown menus below.", view=view, ephemeral=True)
 
 @tree.command(name="check", description="Check the current server and world configuration for this channel.")
 async def check(interaction: discord.Interaction):
     """Check the server and world configuration for the current channel."""
-    channel_id = str(interaction.channel.id)
-    if channel_id in channel_configs:
-        config = channel_configs[channel_id]
+    config, scope = config_store.resolve_channel(interaction.channel)
+    if config:
         server = config.get("server", "Not set")
         world = config.get("world", "Not set")
 
         # Get host link for the configured server and world
-        servers = fetch_servers()
-        server_data = next((s for s in servers if s['code'] == server), None)
-        if server_data:
-            host = server_data.get('host', 'unknown')
+        host = await server_catalog.get_host(server)
+        if host:
             link = f"https://{world}.{host.replace('www.','')}"
         else:
             link = "Unknown (server not found)"
@@ -128,7 +191,8 @@ async def check(interaction: discord.Interaction):
             f"**Current configuration**\n"
             f"Server: ```{server}```\n"
             f"World: ```{world}```\n"
-            f"Link: ```{link}```",
+            f"Link: ```{link}```\n"
+            f"Set for: {SCOPE_LABELS[scope]}",
             ephemeral=True
         )
     else:
@@ -137,86 +201,227 @@ async def check(interaction: discord.Interaction):
             ephemeral=True
         )
 
+async def name_choices(interaction, name, current):
+    """Autocomplete players or tribes of the channel's world."""
+    config, _ = config_store.resolve_channel(interaction.channel)
+    if not config:
+        return []
+    matches = await search_names(config['world'], config['server'], name, current)
+    return [app_commands.Choice(name=label, value=value) for label, value in matches]
+
+@tree.command(name="player", description="Link a player of this channel's world.")
+@app_commands.describe(name="Player name")
+async def player(interaction: discord.Interaction, name: str):
+    config, _ = config_store.resolve_channel(interaction.channel)
+    if not config:
+        await interaction.response.send_message("Please set a world and server using the `/choose` command.", ephemeral=True)
+        return
+    # Loading a cold world's map files can outlast the 3-second interaction deadline
+    await interaction.response.defer()
+    world, server = config['world'], config['server']
+    name = await best_match(world, server, "player", name) or name
+    server_host = await server_catalog.get_host(server)
+    await interaction.followup.send(await format_player(name, world, server, server_host))
+
+@player.autocomplete("name")
+async def player_name_autocomplete(interaction: discord.Interaction, current: str):
+    return await name_choices(interaction, "player", current)
+
+@tree.command(name="tribe", description="Link a tribe of this channel's world.")
+@app_commands.describe(tag="Tribe tag or name")
+async def tribe(interaction: discord.Interaction, tag: str):
+    config, _ = config_store.resolve_channel(interaction.channel)
+    if not config:
+        await interaction.response.send_message("Please set a world and server using the `/choose` command.", ephemeral=True)
+        return
+    # Loading a cold world's map files can outlast the 3-second interaction deadline
+    await interaction.response.defer()
+    world, server = config['world'], config['server']
+    tag = await best_match(world, server, "ally", tag) or tag
+    server_host = await server_catalog.get_host(server)
+    await interaction.followup.send(await format_ally(tag, world, server, server_host))
+
+@tribe.autocomplete("tag")
+async def tribe_tag_autocomplete(interaction: discord.Interaction, current: str):
+    return await name_choices(interaction, "ally", current)
+
+@tree.command(name="near", description="List the villages closest to a coordinate of this channel's world.")
+@app_commands.describe(
+    coord="Coordinate, e.g. 500|500",
+    radius="Only villages within this many fields",
+    tribe="Only villages of this tribe (tag)",
+    barbarian="Only barbarian villages",
+)
+async def near(interaction: discord.Interaction, coord: str, radius: app_commands.Range[int, 1, 100] = None,
+               tribe: str = None, barbarian: bool = False):
+    config, _ = config_store.resolve_channel(interaction.channel)
+    if not config:
+        await interaction.response.send_message("Please set a world and server using the `/choose` command.", ephemeral=True)
+        return
+    match = COORD_PATTERN.fullmatch(coord.strip())
+    if not match:
+        await interaction.response.send_message("Please give a coordinate such as `500|500`.", ephemeral=True)
+        return
+    if tribe and barbarian:
+        await interaction.response.send_message("Barbarian villages belong to no tribe; pick one of the two filters.", ephemeral=True)
+        return
+
+    # The first query of a world may have to load its map files
+    await interaction.response.defer()
+    x, y = int(match.group(1)), int(match.group(2))
+    owners = None
+    if barbarian:
+        owners = {0}
+    elif tribe:
+        owners = await tribe_members(config['world'], config['server'], tribe)
+        if owners is None:
+            await interaction.followup.send(f"**{tribe} not found**")
+            return
+    server_host = await server_catalog.get_host(config['server'])
+    description = await format_nearby(x, y, config['world'], config['server'], server_host, radius, owners)
+    await interaction.followup.send(embed=Embed(title=f"Villages near {x}|{y}", description=description))
+
+@near.autocomplete("tribe")
+async def near_tribe_autocomplete(interaction: discord.Interaction, current: str):
+    return await name_choices(interaction, "ally", current)
+
+def format_seconds(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f} ms"
+
+@tree.command(name="stats", description="Show the bot's performance statistics.")
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    if not interaction.permissions.administrator:
+        await interaction.response.send_message("You need the Administrator permission to see the statistics.", ephemeral=True)
+        return
+
+    lines = ["**Pipeline stages** (count, mean, p99)"]
+    for (stage,) in sorted(metrics.stages.series):
+        lines.append(f"`{stage}`: {metrics.stages.count(stage)}, {format_seconds(metrics.stages.mean(stage))}, "
+                     f"{format_seconds(metrics.stages.quantile(0.99, stage))}")
+
+    messages = ", ".join(f"{result} {count}" for (result,), count in sorted(metrics.messages.values.items()))
+    cache = render_cache.stats()
+    http_calls = sum(metrics.http_requests.values.values())
+    lines += [
+        "",
+        f"**Messages**: {messages or 'none yet'}",
+        f"**Render cache**: {cache['hits']} hits, {cache['misses']} misses ({cache['hit_rate']:.0%}), {cache['size']} entries",
+        f"**HTTP requests**: {http_calls}, **Discord 429s**: {metrics.discord_rate_limits.total()}",
+        f"**Event loop lag**: {format_seconds(metrics.loop_lag.total())}",
+    ]
+    memory = sorted(world_data_store.memory_usage(), key=lambda item: -item[1])
+    if memory:
+        lines.append("**World data**: " + ", ".join(
+            f"{world}/{table} {size / 2**20:.1f} MB" for (_, world, table), size in memory[:10]))
+
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+@bot.event
+async def setup_hook():
+    """Load local state after login, then warm the caches without delaying the gateway connection."""
+    with startup_timer.phase("local state"):
+        config_store.load()
+        webhook_manager.load()
+        emoji_manager.load_cache()
+
+    global warmup_task, metrics_runner, loop_lag_task
+    watch_discord_rate_limits()
+    loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    metrics_runner = await start_metrics_server(metrics_port)
+
+    configured_worlds = config_store.worlds()
+    phases = [
+        ("emojis", emoji_manager.load_emojis()),
+        ("server catalog", server_catalog.get_servers()),
+        (f"{len(configured_worlds)} worlds", prefetch_scheduler.sync()),
+    ]
+    if SYNC_COMMANDS:
+        phases.append(("command sync", tree.sync()))
+    warmup_task = asyncio.create_task(warm_caches(*phases))
+
+@bot.event
+async def on_ready():
+    startup_timer.mark(f"gateway ready as {bot.user}")
+
 @bot.event
 async def on_message(message):
     if message.author == bot.user:
         return
 
+    # Fast path: most chat lines contain no BBCode and cost one regex scan
+    if not contains_bbcode(message.content):
+        metrics.messages.inc("plain")
+        return
+
+    with metrics.time("total"):
+        await format_message(message)
+
+async def format_message(message):
     channel_id = str(message.channel.id)
-    
-    # Check if the channel is configured
-    if channel_id not in channel_configs:
-        await message.channel.send("Please set a world and server using the `/choose` command.")
+    world_config, _ = config_store.resolve_channel(message.channel)
+
+    # Check if the channel is configured, reminding it at most once per cooldown
+    if world_config is None:
+        metrics.messages.inc("unconfigured")
+        if should_send_unconfigured_notice(channel_id):
+            await message.channel.send("Please set a world and server using the `/choose` command.")
         return
 
-    # Pre-check for presence of BBCode tags to avoid unnecessary processing
-    bbcode_patterns = ['[ally]', '[player]', '[coord]', '[building]', '[unit]', '[command]', '[b]', '[i]', '[u]']
-    if not any(pattern in message.content for pattern in bbcode_patterns):
+    # Tokenize once; the same scan tells whether there is anything to format
+    # and which [command] tags decide the embed color
+    with metrics.time("parse"):
+        document = parse_bbcode(message.content)
+    if not document.tags:
+        metrics.messages.inc("no_tags")
         return  # No BBCode tags found, exit early
 
     # Retrieve the channel's world configuration
-    world_config = channel_configs[channel_id]
     world = world_config['world']
     server_code = world_config['server']
-    
-    def determine_embed_color(content):
-        # Define a mapping of commands to their corresponding colors
-        command_colors = {
-            "[command]attack[/command]": 0xA9A9A9,  # Light Grey
-            "[command]attack_small[/command]": 0x00FF00,  # Green
-            "[command]attack_medium[/command]": 0xFFA500,  # Orange
-            "[command]attack_large[/command]": 0xFF0000,  # Red
-            "[command]support[/command]": 0x0000FF,  # Blue
-        }
 
-        # Find matching commands in the content
-        matching_commands = [cmd for cmd in command_colors if cmd in content]
-        # > 1 command found
-        if len(matching_commands) > 1:
-            return 0x808080  # Medium Grey
-        # 1 command found
-        if matching_commands:
-            return command_colors[matching_commands[0]]
-        # no commands found
-        return 0x00FFFF  # Cyan
-
-    
-    updated_content = message.content
-    updated_content = await process_village_bbcode(updated_content, world, server_code)
-    updated_content = await process_player_bbcode(updated_content, world, server_code)
-    updated_content = await process_tribe_bbcode(updated_content, world, server_code)
-    updated_content = process_unit_bbcode(updated_content, emoji_manager)
-    updated_content = process_building_bbcode(updated_content, emoji_manager)
-    updated_content = process_command_bbcode(updated_content, emoji_manager)
-    updated_content = (
-        updated_content
-        .replace("[b]", "**").replace("[/b]", "**")
-        .replace("[i]", "_").replace("[/i]", "_")
-        .replace("[u]", "__").replace("[/u]", "__")
-    )
-    # Add author mention
-    updated_content_with_mention = f"<@{message.author.id}>\n\n{updated_content}"
-    embed_color = determine_embed_color(message.content)
-    embed = Embed(title=f"{world.upper()}", description=updated_content_with_mention, color=embed_color)
+    with metrics.time("render"):
+        units = await render_bbcode_units(document, world, server_code, emoji_manager)
+    updated_content = "".join(text for _, text, _ in units)
 
     # Check if content has changed
-    if updated_content != message.content:
-        try:
-            # Create a webhook to send the message as the author
-            webhook = await message.channel.create_webhook(name="Formatter Bot")
-            
-            # Send the embed via webhook
-            await webhook.send(
-                embed=embed,
-                username=message.author.display_name,
-                avatar_url=message.author.avatar.url if message.author.avatar else message.author.default_avatar.url,
-            )
-            
-            # Delete the original message and clean up the webhook
-            await message.delete()
-            await webhook.delete()
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-
-bot.run(TOKEN)
+    if updated_content == message.content:
+        metrics.messages.inc("unchanged")
+        return
+
+    # Long posts are split over several embeds, sent together, each colored by its own [command] tags;
+    # only a post too long for one message spills over into more
+    title = world.upper()
+    calls = [
+        {
+            "embeds": [Embed(title=title if index == 0 else None, description=description, color=color)
+                       for index, (description, color) in enumerate(embeds)],
+            "username": message.author.display_name,
+            "avatar_url": message.author.avatar.url if message.author.avatar else message.author.default_avatar.url,
+        }
+        # Add author mention
+        for embeds in layout_embeds(units, title, prefix=f"<@{message.author.id}>\n\n")
+    ]
+
+    # Queued behind the channel's earlier reposts; the original is deleted once it is sent
+    outbound.submit(message, calls)
+    metrics.messages.inc("formatted")
+
+async def main():
+    discord.utils.setup_logging()
+    try:
+        async with bot:
+            await bot.start(TOKEN)
+    finally:
+        prefetch_scheduler.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await http_client.close()
+        config_store.close()
+        shutdown_parse_pool()
+
+if __name__ == "__main__":
+    if not TOKEN or not APP_ID:
+        raise ValueError("Token or Application ID not found! Make sure 'DISCORD_TOKEN' and 'APP_ID' are set in your .env file.")
+    asyncio.run(main())
+
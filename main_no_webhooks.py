@@ -1,26 +1,24 @@
 #main.py
 import os
-import json
 import re
+import time
+import asyncio
 import discord
 from discord.ext import commands
 from discord.ui import Select, View
 from discord import app_commands
 from dotenv import load_dotenv
-from commands.village import process_village_bbcode
-from commands.player import process_player_bbcode
-from commands.ally import process_tribe_bbcode
-from commands.icons import process_unit_bbcode, process_building_bbcode, process_command_bbcode
-from commands.servers import fetch_servers, fetch_worlds
-from utils.api import fetch_emojis
+from commands.bbcode import contains_bbcode, parse_bbcode, render_bbcode
+from commands.servers import fetch_servers, fetch_worlds, server_catalog
 from commands.emojis import EmojiManager
+from commands.world_data import shutdown_parse_pool
+from utils.http import http_client
+from utils.config_store import ConfigStore
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 APP_ID = os.getenv("APP_ID")
-if not TOKEN or not APP_ID:
-    raise ValueError("Token or Application ID not found! Make sure 'DISCORD_TOKEN' and 'APP_ID' are set in your .env file.")
 
 # Discord Bot Setup
 intents = discord.Intents.default()
@@ -29,38 +27,21 @@ bot = discord.Client(intents=intents)
 tree = app_commands.CommandTree(bot)
 
 emoji_manager = EmojiManager(APP_ID, TOKEN)
-emoji_manager.load_emojis()
 
-# Fetch app-specific emojis
-app_emojis = fetch_emojis(APP_ID, TOKEN)
+# Server/world settings per channel, category and guild
+config_store = ConfigStore()
 
-# Dictionary to store world configurations per channel
-channel_configs = {}
+# Unconfigured channels are reminded to run /choose at most once per cooldown
+UNCONFIGURED_NOTICE_COOLDOWN = 3600
+unconfigured_notices = {}  # channel id -> time of the last reminder
 
-# Helper functions to manage configurations
-def save_configs():
-    try:
-        with open("channel_configs.json", "w") as f:
-            json.dump(channel_configs, f)
-    except IOError as e:
-        print(f"Error saving configuration: {e}")
-
-def load_configs():
-    global channel_configs
-    if os.path.exists("channel_configs.json"):
-        if os.path.getsize("channel_configs.json") > 0:
-            try:
-                with open("channel_configs.json", "r") as f:
-                    channel_configs = json.load(f)
-            except json.JSONDecodeError:
-                channel_configs = {}
-        else:
-            channel_configs = {}
-    else:
-        channel_configs = {}
-
-# Load the saved configs on startup
-load_configs()
+def should_send_unconfigured_notice(channel_id):
+    now = time.monotonic()
+    last_notice = unconfigured_notices.get(channel_id)
+    if last_notice is not None and now - last_notice < UNCONFIGURED_NOTICE_COOLDOWN:
+        return False
+    unconfigured_notices[channel_id] = now
+    return True
 
 class SelectServerWorld(View):
     def __init__(self, server_data):
@@ -78,7 +59,7 @@ class SelectServerWorld(View):
 
     async def on_server_select(self, interaction: discord.Interaction):
         self.selected_server = interaction.data['values'][0]
-        worlds = fetch_worlds(self.selected_server)
+        worlds = await fetch_worlds(self.selected_server)
         if not worlds:
             await interaction.response.send_message("No worlds found for this server.", ephemeral=True)
             return
@@ -93,14 +74,14 @@ class SelectServerWorld(View):
     async def on_world_select(self, interaction: discord.Interaction):
         selected_world = interaction.data['values'][0]
         channel_id = str(interaction.channel.id)
-        channel_configs[channel_id] = {"world": selected_world, "server": self.selected_server}
-        save_configs()
+        config_store.set("channel", channel_id, selected_world, self.selected_server)
+        unconfigured_notices.pop(channel_id, None)
         await interaction.response.send_message(f"Server: {self.selected_server}, World: {selected_world} set for this channel.", ephemeral=True)
 
 # Slash command to choose server and world
 @tree.command(name="choose", description="Select the server and world for this channel.")
 async def choose(interaction: discord.Interaction):
-    server_data = fetch_servers()
+    server_data = await fetch_servers()
     if not server_data:
         await interaction.response.send_message("No servers available. Please try again later.", ephemeral=True)
         return
@@ -112,17 +93,14 @@ async def choose(interaction: discord.Interaction):
 @tree.command(name="check", description="Check the current server and world configuration for this channel.")
 async def check(interaction: discord.Interaction):
     """Check the server and world configuration for the current channel."""
-    channel_id = str(interaction.channel.id)
-    if channel_id in channel_configs:
-        config = channel_configs[channel_id]
+    config, _ = config_store.resolve_channel(interaction.channel)
+    if config:
         server = config.get("server", "Not set")
         world = config.get("world", "Not set")
 
         # Get host link for the configured server and world
-        servers = fetch_servers()
-        server_data = next((s for s in servers if s['code'] == server), None)
-        if server_data:
-            host = server_data.get('host', 'unknown')
+        host = await server_catalog.get_host(server)
+        if host:
             link = f"https://{world}.{host.replace('www.','')}"
         else:
             link = "Unknown (server not found)"
@@ -141,6 +119,13 @@ async def check(interaction: discord.Interaction):
             ephemeral=True
         )
 
+@bot.event
+async def setup_hook():
+    # Load local state, then warm the emoji catalog while the gateway connects
+    config_store.load()
+    emoji_manager.load_cache()
+    bot.loop.create_task(emoji_manager.load_emojis())
+
 @bot.event
 async def on_ready():
     print(f"Bot is ready. Logged in as {bot.user}")
@@ -150,41 +135,43 @@ async def on_message(message):
     if message.author == bot.user:
         return
 
+    # Fast path: most chat lines contain no BBCode and cost one regex scan
+    if not contains_bbcode(message.content):
+        return
+
     channel_id = str(message.channel.id)
-    if channel_id not in channel_configs:
-        await message.channel.send("Please set a world and server using the `/choose` command.")
+    world_config, _ = config_store.resolve_channel(message.channel)
+    if world_config is None:
+        if should_send_unconfigured_notice(channel_id):
+            await message.channel.send("Please set a world and server using the `/choose` command.")
         return
 
-    world_config = channel_configs.get(channel_id)
     world = world_config['world']
     server_code = world_config['server']
 
-    # Pre-check for presence of BBCode tags to avoid unnecessary processing
-    if not any(pattern in message.content for pattern in ['[ally]', '[player]', '[coord]', '[building]', '[unit]', '[command]', '[b]', '[i]', '[u]']):
+    # Tokenize once; a message without BBCode tags needs no further processing
+    document = parse_bbcode(message.content)
+    if not document.tags:
         return  # No BBCode tags found, exit early
 
-    # Process BBCode only if tags are present
-    updated_content = message.content
-
-    # Process each BBCode type
-    updated_content = await process_village_bbcode(updated_content, world, server_code)
-    updated_content = await process_player_bbcode(updated_content, world, server_code)
-    updated_content = await process_tribe_bbcode(updated_content, world, server_code)
-    updated_content = process_unit_bbcode(updated_content, emoji_manager)
-    updated_content = process_building_bbcode(updated_content, emoji_manager)
-    updated_content = process_command_bbcode(updated_content, emoji_manager)
-
-    # Replace [b], [i], [u] BBCode with Discord Markdown
-    updated_content = (
-        updated_content
-        .replace("[b]", "**").replace("[/b]", "**")
-        .replace("[i]", "_").replace("[/i]", "_")
-        .replace("[u]", "__").replace("[/u]", "__")
-    )
+    updated_content = await render_bbcode(document, world, server_code, emoji_manager)
 
     # Only reply if the content has changed
     if updated_content != message.content:
         await message.reply(updated_content)
 
 # Run the bot
-bot.run(TOKEN)
+async def main():
+    discord.utils.setup_logging()
+    try:
+        async with bot:
+            await bot.start(TOKEN)
+    finally:
+        await http_client.close()
+        config_store.close()
+        shutdown_parse_pool()
+
+if __name__ == "__main__":
+    if not TOKEN or not APP_ID:
+        raise ValueError("Token or Application ID not found! Make sure 'DISCORD_TOKEN' and 'APP_ID' are set in your .env file.")
+    asyncio.run(main())
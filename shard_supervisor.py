@@ -0,0 +1,122 @@
+# shard_supervisor.py
+"""
+Run the bot as several worker processes, each connected to a slice of the shards.
+
+    python shard_supervisor.py --workers 4 --shards 8
+
+Workers share the snapshots directory and the config database, so a world's
+map files are downloaded by one worker and memory-mapped by the others.
+A worker that exits is restarted after a growing delay.
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import subprocess
+
+# Restart delays for a worker that keeps crashing
+RESTART_DELAY_MIN = 5
+RESTART_DELAY_MAX = 300
+# A worker that ran this long is considered healthy again
+HEALTHY_UPTIME = 600
+
+
+def shard_slices(shard_count, workers):
+    """Split shard ids 0..shard_count-1 into contiguous slices, one per worker."""
+    slices = []
+    start = 0
+    for worker in range(workers):
+        size = shard_count // workers + (1 if worker < shard_count % workers else 0)
+        slices.append(list(range(start, start + size)))
+        start += size
+    return [shard_ids for shard_ids in slices if shard_ids]
+
+
+class Worker:
+    def __init__(self, shard_ids, shard_count, script):
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.script = script
+        self.process = None
+        self.started_at = 0
+        self.failures = 0
+        self.restart_at = 0
+
+    @property
+    def label(self):
+        return f"shards {self.shard_ids[0]}-{self.shard_ids[-1]}"
+
+    def start(self):
+        env = dict(os.environ)
+        env["SHARD_COUNT"] = str(self.shard_count)
+        env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in self.shard_ids)
+        self.process = subprocess.Popen([sys.executable, self.script], env=env)
+        self.started_at = time.monotonic()
+        print(f"Supervisor: started {self.label} (pid {self.process.pid})")
+
+    def check(self):
+        """Restart the worker if it exited and its restart delay has passed."""
+        now = time.monotonic()
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            if now - self.started_at >= HEALTHY_UPTIME:
+                self.failures = 0
+            self.failures += 1
+            delay = min(RESTART_DELAY_MAX, RESTART_DELAY_MIN * 2 ** (self.failures - 1))
+            self.restart_at = now + delay
+            self.process = None
+            print(f"Supervisor: {self.label} exited with code {code}, restarting in {delay}s")
+        if now >= self.restart_at:
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, timeout):
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded worker processes.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--shards", type=int, default=None, help="total shard count (defaults to one per worker)")
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"))
+    args = parser.parse_args()
+
+    shard_count = args.shards or args.workers
+    workers = [Worker(shard_ids, shard_count, args.script) for shard_ids in shard_slices(shard_count, args.workers)]
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for worker in workers:
+        worker.start()
+    while not stopping:
+        time.sleep(1)
+        for worker in workers:
+            worker.check()
+
+    print("Supervisor: stopping workers")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# tests/test_bbcode.py
+"""parse_bbcode against what the old chain of regex passes and str.replace calls produced."""
+import pytest
+from commands.bbcode import parse_bbcode, Entity, FORMAT_MARKERS
+
+
+def markdown(content):
+    """Render a parsed message with every entity shown as <tag:value>, as a lookup would replace it."""
+    parts = []
+
+    def render(node):
+        for child in node.children:
+            if isinstance(child, str):
+                parts.append(child)
+            elif isinstance(child, Entity):
+                parts.append(f"<{child.tag}:{child.value}>")
+            else:
+                parts.append(FORMAT_MARKERS[child.tag])
+                render(child)
+                parts.append(FORMAT_MARKERS[child.tag])
+
+    render(parse_bbcode(content))
+    return "".join(parts)
+
+
+# Messages the old regex passes and the single scan render the same
+SAME_AS_BEFORE = [
+    ("no tags at all", "no tags at all"),
+    ("[b]bold[/b] and [i]it[/i] and [u]under[/u]", "**bold** and _it_ and __under__"),
+    ("[b]a [i]b [u]c[/u][/i][/b]", "**a _b __c___**"),
+    ("[b]two\nlines[/b]", "**two\nlines**"),
+    ("[coord]500|500[/coord] to [coord]1|2[/coord]", "<coord:500|500> to <coord:1|2>"),
+    ("[b][coord]500|500[/coord][/b]", "**<coord:500|500>**"),
+    ("[player]Bob[/player] of [ally]TAG[/ally]", "<player:Bob> of <ally:TAG>"),
+    ("[unit]spear[/unit][unit]axe[/unit]", "<unit:spear><unit:axe>"),
+    ("[command]attack[/command] [building]main[/building]", "<command:attack> <building:main>"),
+    # Not a coordinate, or a value spanning lines: left as written
+    ("[coord]500|abc[/coord]", "[coord]500|abc[/coord]"),
+    ("[coord]500 500[/coord]", "[coord]500 500[/coord]"),
+    ("[player]Bob\nAlice[/player]", "[player]Bob\nAlice[/player]"),
+    # Never closed: left as written
+    ("[player]Bob", "[player]Bob"),
+    ("[coord]500|500", "[coord]500|500"),
+    ("[/player]Bob", "[/player]Bob"),
+]
+
+# Where the old replaces produced unbalanced markdown, the tree keeps it balanced
+CHANGED_ON_PURPOSE = [
+    # An unclosed tag is closed at the end instead of leaving a dangling marker
+    ("[b]never closed", "**never closed**", "**never closed"),
+    # A closing tag without an opening one stays text
+    ("a[/b]b", "a[/b]b", "a**b"),
+    ("[/i]", "[/i]", "_"),
+    # Closing [b] closes the [i] inside it too, so the late [/i] is stray text
+    ("[b][i]x[/b][/i]", "**_x_**[/i]", "**_x**_"),
+]
+
+
+@pytest.mark.parametrize("content, expected", SAME_AS_BEFORE)
+def test_renders_like_the_regex_passes(content, expected):
+    assert markdown(content) == expected
+
+
+@pytest.mark.parametrize("content, expected, before", CHANGED_ON_PURPOSE)
+def test_keeps_markdown_balanced(content, expected, before):
+    assert markdown(content) == expected != before
+
+
+def test_records_the_tags_found():
+    document = parse_bbcode("[b]x[/b] [coord]1|2[/coord] [coord]bad[/coord] [/i]")
+    assert document.tags == {"b", "coord"}
+    assert parse_bbcode("[coord]bad[/coord] [/u]").tags == set()
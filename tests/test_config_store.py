@@ -0,0 +1,62 @@
+# tests/test_config_store.py
+"""Importing the channel_configs.json of older versions into the config database."""
+import json
+import sqlite3
+from utils.config_store import ConfigStore
+
+LEGACY_CONFIGS = {
+    "100": {"world": "pt103", "server": "pt"},
+    "200": {"world": "en140", "server": "en"},
+    "300": {"world": "nl90"},  # half-written by an old version, skipped
+}
+
+
+def open_store(tmp_path, legacy=LEGACY_CONFIGS):
+    legacy_path = tmp_path / "channel_configs.json"
+    if isinstance(legacy, str):
+        legacy_path.write_text(legacy)
+    elif legacy is not None:
+        legacy_path.write_text(json.dumps(legacy))
+    store = ConfigStore(str(tmp_path / "configs.db"), str(legacy_path))
+    store.load()
+    return store
+
+
+def test_legacy_channels_are_imported(tmp_path):
+    store = open_store(tmp_path)
+    assert store.configs["channel"] == {
+        "100": {"world": "pt103", "server": "pt"},
+        "200": {"world": "en140", "server": "en"},
+    }
+    assert store.resolve(100) == ({"world": "pt103", "server": "pt"}, "channel")
+    assert store.resolve(300) == (None, None)
+    store.close()
+
+
+def test_legacy_file_is_imported_once(tmp_path):
+    open_store(tmp_path).close()
+    # A setting removed after the import must not come back from the old file
+    connection = sqlite3.connect(tmp_path / "configs.db")
+    with connection:
+        connection.execute("DELETE FROM configs WHERE scope_id = '200'")
+    connection.close()
+
+    store = open_store(tmp_path)
+    assert set(store.configs["channel"]) == {"100"}
+    store.close()
+
+
+def test_unreadable_legacy_file_is_retried(tmp_path):
+    store = open_store(tmp_path, legacy="{not json")
+    assert store.configs["channel"] == {}
+    store.close()
+
+    store = open_store(tmp_path)
+    assert set(store.configs["channel"]) == {"100", "200"}
+    store.close()
+
+
+def test_no_legacy_file(tmp_path):
+    store = open_store(tmp_path, legacy=None)
+    assert store.configs == {"channel": {}, "category": {}, "guild": {}}
+    store.close()
@@ -0,0 +1,41 @@
+# tests/test_embeds.py
+"""Splitting long posts into embeds and messages within Discord's limits."""
+from commands.bbcode import layout_embeds, text_units, COMMAND_COLORS
+from commands.bbcode import EMBED_DESCRIPTION_LIMIT, MESSAGE_EMBEDS_LIMIT, MAX_EMBEDS_PER_MESSAGE
+
+
+def test_respects_discord_limits():
+    units = []
+    for line in range(600):
+        if line % 100 == 0:
+            units.append(("open", "**", None))
+        command = "attack_large" if line >= 300 else "support"
+        units += [("entity", f"[[Village {line}] (100 points)](<https://example.test/{line}>)", None),
+                  ("text", " lands ", None), ("entity", ":sword:", command), ("newline", "\n", None)]
+        if line % 100 == 99:
+            units.append(("close", "**", None))
+    title = "T1"
+    messages = layout_embeds(units, title, prefix="<@1>\n\n")
+
+    assert len(messages) > 1
+    for embeds in messages:
+        assert 1 <= len(embeds) <= MAX_EMBEDS_PER_MESSAGE
+        assert all(len(description) <= EMBED_DESCRIPTION_LIMIT for description, _ in embeds)
+        assert len(title) + sum(len(description) for description, _ in embeds) <= MESSAGE_EMBEDS_LIMIT
+        for description, _ in embeds:
+            # Bold left open at a cut is closed and reopened around it
+            assert description.count("**") % 2 == 0
+    colors = [color for embeds in messages for _, color in embeds]
+    assert colors[0] == COMMAND_COLORS["support"] and colors[-1] == COMMAND_COLORS["attack_large"]
+
+    text = "".join(description for embeds in messages for description, _ in embeds).replace("**", "")
+    expected = "<@1>\n\n" + "".join(unit[1] for unit in units if unit[0] not in ("open", "close"))
+    assert text.replace("\n", "") == expected.replace("\n", "")
+
+
+def test_cuts_an_overlong_line_at_spaces():
+    messages = layout_embeds(text_units("word " * 2000))
+    descriptions = [description for embeds in messages for description, _ in embeds]
+    assert all(len(description) <= EMBED_DESCRIPTION_LIMIT for description in descriptions)
+    assert all(description.endswith(" ") for description in descriptions[:-1])
+    assert "".join(descriptions) == "word " * 2000
@@ -0,0 +1,59 @@
+# tests/test_render_cache.py
+"""Eviction and invalidation of rendered fragments."""
+from commands.render_cache import RenderCache
+
+
+def key(value, world="pt1"):
+    return ("pt", world, "coord", value)
+
+
+def test_least_recently_used_fragment_is_evicted():
+    cache = RenderCache(max_size=2)
+    cache.put(key("1|1"), "one", [("village", 1)])
+    cache.put(key("2|2"), "two", [("village", 2)])
+    assert cache.get(key("1|1")) == "one"  # now the most recently used
+    cache.put(key("3|3"), "three", [("village", 3)])
+
+    assert cache.get(key("2|2")) is None
+    assert (cache.get(key("1|1")), cache.get(key("3|3"))) == ("one", "three")
+    # The evicted fragment no longer shows up as a dependent
+    assert ("pt", "pt1", "village", 2) not in cache.dependents
+    assert cache.stats()["size"] == 2
+
+
+def test_replacing_a_fragment_drops_its_old_dependencies():
+    cache = RenderCache()
+    cache.put(key("1|1"), "old", [("village", 1), ("player", 5)])
+    cache.put(key("1|1"), "new", [("village", 1)])
+    cache.invalidate_entities("pt", "pt1", "player", [5])
+    assert cache.get(key("1|1")) == "new"
+
+
+def test_changed_entities_drop_their_fragments_only():
+    cache = RenderCache()
+    cache.put(key("1|1"), "village 1 of player 5", [("village", 1), ("player", 5)])
+    cache.put(key("2|2"), "village 2 of player 6", [("village", 2), ("player", 6)])
+    cache.put(key("9|9"), "not found", [("village", None)])
+    cache.put(key("1|1", world="pt2"), "other world", [("village", 1), ("player", 5)])
+
+    cache.invalidate_entities("pt", "pt1", "player", [5])
+    assert cache.get(key("1|1")) is None
+    assert cache.get(key("2|2")) is not None
+    assert cache.get(key("1|1", world="pt2")) is not None
+    # A player changing doesn't make a missing village appear
+    assert cache.get(key("9|9")) == "not found"
+
+    # Any village change may add the one that wasn't found
+    cache.invalidate_entities("pt", "pt1", "village", [])
+    assert cache.get(key("9|9")) is None
+    assert cache.get(key("2|2")) is not None
+
+
+def test_invalidating_a_world_keeps_the_others():
+    cache = RenderCache()
+    cache.put(key("1|1"), "pt1", [("village", 1)])
+    cache.put(key("1|1", world="pt2"), "pt2", [("village", 1)])
+    cache.invalidate("pt", "pt1")
+    assert cache.get(key("1|1")) is None
+    assert cache.get(key("1|1", world="pt2")) == "pt2"
+    assert set(cache.dependents) == {("pt", "pt2", "village", 1)}
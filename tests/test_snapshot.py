@@ -0,0 +1,54 @@
+# tests/test_snapshot.py
+"""Writing map tables to snapshot files and memory-mapping them back."""
+from commands import snapshot
+from commands.map_tables import VillageTable, AllyTable
+
+VILLAGES = "\n".join([
+    "1,Village+One,500,500,7,120,0",
+    "2,Caf%C3%A9+%C3%A0+la+carte,501,499,0,26,3",
+    "3,%2B%2B+%21%21,0,999,9,10000,0",
+])
+ALLIES = "\n".join([
+    "1,Tribe+One,ONE,3,10,1000,1000,2",
+    "2,%C3%89quipe,%C3%89Q,5,20,2000,2000,1",
+])
+
+
+def parse(table_class, text):
+    return table_class(*table_class.parse_rows(text))
+
+
+def round_trip(table, tmp_path, **validators):
+    path = str(tmp_path / f"{table.NAME}.snap")
+    snapshot.write_snapshot(path, table, **validators)
+    return snapshot.read_snapshot(path)
+
+
+def test_village_table_round_trip(tmp_path):
+    table = parse(VillageTable, VILLAGES)
+    loaded, header = round_trip(table, tmp_path, etag='"abc"', last_modified="Sun, 18 Oct 2026 06:00:00 GMT")
+    assert (header["etag"], header["last_modified"], header["rows"]) == ('"abc"', "Sun, 18 Oct 2026 06:00:00 GMT", 3)
+    assert loaded.size == table.size
+    assert [loaded.record(row) for row in range(3)] == [table.record(row) for row in range(3)]
+    assert loaded.lookup(501, 499)["name"] == "Café à la carte"
+    assert loaded.lookup(0, 999)["name"] == "++ !!"
+    assert loaded.lookup(502, 499) is None
+
+
+def test_ally_table_round_trip(tmp_path):
+    table = parse(AllyTable, ALLIES)
+    loaded, header = round_trip(table, tmp_path)
+    assert header["etag"] is None
+    assert [loaded.record(row) for row in range(2)] == [table.record(row) for row in range(2)]
+    assert loaded.lookup("éq")["name"] == "Équipe"
+
+
+def test_unusable_files_are_ignored(tmp_path):
+    path = tmp_path / "village.snap"
+    assert snapshot.read_snapshot(str(path)) is None
+    path.write_bytes(b"not a snapshot at all")
+    assert snapshot.read_snapshot(str(path)) is None
+
+    snapshot.write_snapshot(str(path), parse(VillageTable, VILLAGES))
+    path.write_bytes(path.read_bytes()[:-8])  # cut short
+    assert snapshot.read_snapshot(str(path)) is None
@@ -0,0 +1,123 @@
+# tests/test_world_patching.py
+"""Two successive exports patched into a world: lookups, joins and the render cache."""
+import time
+import asyncio
+import pytest
+from commands import snapshot
+from commands.bbcode import parse_bbcode, resolve_entities
+from commands.map_tables import MAP_TABLES, parse_rows
+from commands.render_cache import render_cache
+from commands.servers import server_catalog
+from commands.world_data import world_data_store
+
+SERVER = "test"
+WORLD = "t1"
+
+ALLIES = [f"{ally_id},Tribe+{ally_id},{tag},3,10,1000,1000,{ally_id}"
+          for ally_id, tag in ((1, "ALPHA"), (2, "BETA"), (3, "GAMMA"))]
+
+
+def players(renamed=False, moved=False):
+    lines = []
+    for player_id in range(1, 11):
+        name = "Renamed" if renamed and player_id == 2 else f"Player{player_id}"
+        ally = 1 if player_id <= 3 else 2 if player_id <= 6 else 0
+        if moved and player_id == 1:
+            ally = 3
+        lines.append(f"{player_id},{name},{ally},2,500,{player_id}")
+    return lines
+
+
+def villages(second=False):
+    lines = []
+    for village_id in range(1, 21):
+        owner = village_id % 11
+        if second and village_id == 1:
+            owner = 2  # conquered by Player2
+        if second and village_id == 20:
+            continue  # deleted
+        lines.append(f"{village_id},Village+{village_id},{100 + village_id},100,{owner},{village_id * 10},0")
+    if second:
+        lines.append("21,New+village,200,200,3,26,0")
+    return lines
+
+
+def rows(name, lines):
+    return parse_rows(name, "\n".join(lines).encode())
+
+
+@pytest.fixture
+def world():
+    render_cache.entries.clear()
+    render_cache.dependents.clear()
+    # Links need the server list; fake a fresh one instead of fetching it
+    server_catalog.cache["servers"] = ([{"code": SERVER, "host": "www.example.test"}], time.monotonic())
+    server_catalog.hosts[SERVER] = "www.example.test"
+
+    world_data = world_data_store.get_world(WORLD, SERVER)
+    for name, lines in (("ally", ALLIES), ("player", players()), ("village", villages())):
+        world_data.set_table(name, MAP_TABLES[name](*rows(name, lines)))
+        world_data.loaded_at[name] = time.monotonic()
+    yield world_data
+    del world_data_store.worlds[(SERVER, WORLD)]
+
+
+def render(coords):
+    document = parse_bbcode(" ".join(f"[coord]{coord}[/coord]" for coord in coords))
+    fragments = asyncio.run(resolve_entities(document, WORLD, SERVER, None))
+    return {key[1]: fragment for key, fragment in fragments.items()}
+
+
+def cached(coord):
+    return (SERVER, WORLD, "coord", coord) in render_cache.entries
+
+
+def test_first_export_is_joined(world):
+    village = world.tables["village"].lookup(101, 100)
+    assert (village["owner_name"], village["ally_tag"]) == ("Player1", "ALPHA")
+    assert world.tables["village"].lookup(111, 100)["owner_name"] is None  # owner 0: barbarian
+    assert render(["101|100"])["101|100"].endswith(" – Player1 [ALPHA]")
+
+
+def test_two_exports_patch_in_place(world):
+    village_table = world.tables["village"]
+    player_table = world.tables["player"]
+    render(["101|100", "105|100", "112|100", "200|200"])
+    assert all(cached(coord) for coord in ("101|100", "105|100", "112|100", "200|200"))
+    version = world.version
+
+    asyncio.run(world.refresh_table("village", rows("village", villages(second=True))))
+    assert world.version > version
+    assert world.tables["village"] is village_table
+    assert village_table.lookup(120, 100) is None
+    assert village_table.lookup(200, 200)["id"] == 21
+    assert village_table.lookup(101, 100)["owner"] == 2
+    # Changed, added and "not found" entries go; the untouched ones stay
+    assert not cached("101|100") and not cached("200|200")
+    assert cached("105|100") and cached("112|100")
+
+    asyncio.run(world.refresh_table("player", rows("player", players(renamed=True, moved=True))))
+    assert world.tables["player"] is player_table
+    # Village 12 belongs to Player1, who changed tribe
+    assert not cached("112|100") and cached("105|100")
+
+    fragments = render(["101|100", "112|100", "200|200"])
+    assert fragments["101|100"].endswith(" – Renamed [ALPHA]")
+    assert fragments["112|100"].endswith(" – Player1 [GAMMA]")
+    assert fragments["200|200"].endswith(" – Player3 [ALPHA]")
+    assert village_table.find_row(200, 200) == len(villages())  # appended after the first export's rows
+
+
+def test_snapshot_backed_table_is_patched_on_a_copy(world, tmp_path):
+    path = str(tmp_path / "village.snap")
+    snapshot.write_snapshot(path, world.tables["village"])
+    table, _ = snapshot.read_snapshot(path)
+    world.set_table("village", table)
+    assert not table.writable
+    assert table.lookup(101, 100)["owner_name"] == "Player1"
+
+    asyncio.run(world.refresh_table("village", rows("village", villages(second=True))))
+    assert world.tables["village"] is table and table.writable
+    assert table.lookup(101, 100)["owner_name"] == "Player2"
+    assert table.lookup(120, 100) is None
+    assert table.lookup(200, 200)["name"] == "New village"
@@ -0,0 +1,146 @@
+# utils/config_store.py
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+CONFIG_DB = os.getenv("CONFIG_DB", "channel_configs.db")
+# Channel configs saved by older versions, imported on first run
+LEGACY_CONFIG_FILE = "channel_configs.json"
+
+# Most specific first: a channel setting overrides its category's, which overrides the guild's
+SCOPES = ("channel", "category", "guild")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    scope TEXT NOT NULL,
+    scope_id TEXT NOT NULL,
+    server TEXT NOT NULL,
+    world TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (scope, scope_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ConfigStore:
+    """
+    Server and world settings per channel, category or guild.
+
+    All settings are held in memory, so resolving a channel is a few dict
+    lookups. Changes apply to memory at once and are written behind, row by
+    row, to a SQLite database in WAL mode on a single background thread.
+
+    Sharded worker processes share the database. A guild always lives on one
+    shard, so the process that writes a guild's settings is also the only
+    one reading them and its in-memory copy never goes stale.
+    """
+
+    def __init__(self, path=CONFIG_DB, legacy_path=LEGACY_CONFIG_FILE):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.configs = {scope: {} for scope in SCOPES}  # scope -> id -> {"world", "server"}
+        # One writer thread keeps writes ordered and the connection on one thread
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="config-store")
+        self.connection = None
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        return connection
+
+    def load(self):
+        """Open the database, import the legacy JSON file once, and read every setting."""
+        self.connection = self.connect()
+        self.migrate_legacy_file()
+        rows = self.connection.execute("SELECT scope, scope_id, server, world FROM configs").fetchall()
+        configs = {scope: {} for scope in SCOPES}
+        for scope, scope_id, server, world in rows:
+            if scope in configs:
+                configs[scope][scope_id] = {"world": world, "server": server}
+        self.configs = configs
+
+    def migrate_legacy_file(self):
+        migrated = self.connection.execute("SELECT value FROM meta WHERE key = 'legacy_json_migrated'").fetchone()
+        if migrated or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, "r") as f:
+                legacy_configs = json.load(f) if os.path.getsize(self.legacy_path) > 0 else {}
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"Error reading {self.legacy_path}, not migrating it: {e}")
+            return
+
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO configs (scope, scope_id, server, world, updated_at) VALUES ('channel', ?, ?, ?, ?)",
+                [(channel_id, config["server"], config["world"], now)
+                 for channel_id, config in legacy_configs.items()
+                 if "server" in config and "world" in config]
+            )
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_json_migrated', ?)", (str(now),))
+        print(f"Migrated {len(legacy_configs)} channel configs from {self.legacy_path}")
+
+    def resolve(self, channel_id, parent_id=None, category_id=None, guild_id=None):
+        """Return (config, scope) for the most specific setting that applies, or (None, None)."""
+        for scope, scope_id in (("channel", channel_id), ("channel", parent_id),
+                                ("category", category_id), ("guild", guild_id)):
+            if scope_id is not None:
+                config = self.configs[scope].get(str(scope_id))
+                if config is not None:
+                    return config, scope
+        return None, None
+
+    def resolve_channel(self, channel):
+        """Resolve a discord channel or thread; threads inherit their parent channel's setting."""
+        guild = getattr(channel, "guild", None)
+        return self.resolve(
+            channel.id,
+            parent_id=getattr(channel, "parent_id", None),
+            category_id=getattr(channel, "category_id", None),
+            guild_id=guild.id if guild else None,
+        )
+
+    def set(self, scope, scope_id, world, server):
+        """Store a setting; returns a future that completes once it is on disk."""
+        scope_id = str(scope_id)
+        self.configs[scope][scope_id] = {"world": world, "server": server}
+        return self.write(
+            "INSERT INTO configs (scope, scope_id, server, world, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, scope_id) DO UPDATE SET server = excluded.server, world = excluded.world, "
+            "updated_at = excluded.updated_at",
+            (scope, scope_id, server, world, time.time())
+        )
+
+    def write(self, sql, params):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor, self.execute, sql, params)
+
+    def execute(self, sql, params):
+        try:
+            with self.connection:
+                self.connection.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Error saving configuration: {e}")
+
+    def worlds(self):
+        """Return the distinct (world, server) pairs configured anywhere."""
+        return {(config["world"], config["server"])
+                for configs in self.configs.values()
+                for config in configs.values()}
+
+    def close(self):
+        # Wait for pending writes before closing the connection
+        self.executor.shutdown(wait=True)
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
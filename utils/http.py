@@ -0,0 +1,152 @@
+# utils/http.py
+import json
+import random
+import asyncio
+import aiohttp
+from contextlib import asynccontextmanager
+from utils.metrics import metrics
+
+# Limits shared by every outgoing request of the bot
+MAX_CONNECTIONS = 64
+MAX_CONNECTIONS_PER_HOST = 8
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=60, sock_connect=10, sock_read=30)
+
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds, doubled after every attempt
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpResponse:
+    """A fully read response together with its cache validators."""
+
+    def __init__(self, status, body=b"", etag=None, last_modified=None):
+        self.status = status
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def ok(self):
+        return self.status == 200
+
+    def text(self, encoding="utf-8"):
+        return self.body.decode(encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class HttpClient:
+    """
+    Application-wide aiohttp session with a bounded connection pool.
+
+    Connections are kept alive between requests, failed requests are retried
+    with exponential backoff, and callers holding a previous copy of a
+    resource can pass its validators to get a cheap 304 when it is unchanged.
+    """
+
+    def __init__(self, limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST,
+                 timeout=HTTP_TIMEOUT, max_retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = None
+
+    def get_session(self):
+        # The session has to be created inside the running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def get(self, url, headers=None, etag=None, last_modified=None):
+        """
+        GET a URL and return an HttpResponse.
+
+        With etag/last_modified the request is conditional and a 304 response
+        with an empty body means the caller's copy is still current.
+        Network errors are raised once all retries are used up.
+        """
+        request_headers = self.request_headers(headers, etag, last_modified)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.get_session().get(url, headers=request_headers) as response:
+                    metrics.http_requests.inc(str(response.status))
+                    if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                        body = await response.read() if response.status != 304 else b""
+                        return HttpResponse(
+                            response.status,
+                            body,
+                            etag=response.headers.get("ETag", etag),
+                            last_modified=response.headers.get("Last-Modified", last_modified)
+                        )
+                    retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.http_requests.inc("error")
+                if attempt == self.max_retries:
+                    raise
+
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+
+    @asynccontextmanager
+    async def stream(self, url, headers=None, etag=None, last_modified=None):
+        """
+        GET a URL and yield the aiohttp response before its body is read.
+
+        Retries like get() until a final status arrives; the caller reads the
+        body incrementally from response.content. Errors while reading it are
+        not retried.
+        """
+        request_headers = self.request_headers(headers, etag, last_modified)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self.get_session().get(url, headers=request_headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.http_requests.inc("error")
+                if attempt == self.max_retries:
+                    raise
+            else:
+                metrics.http_requests.inc(str(response.status))
+                if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                    try:
+                        yield response
+                    finally:
+                        response.release()
+                    return
+                retry_after = response.headers.get("Retry-After")
+                response.release()
+
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+
+    def request_headers(self, headers, etag, last_modified):
+        request_headers = dict(headers or {})
+        if etag:
+            request_headers["If-None-Match"] = etag
+        if last_modified:
+            request_headers["If-Modified-Since"] = last_modified
+        return request_headers
+
+    def retry_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Jitter keeps parallel retries from hitting the server in lockstep
+        return self.backoff * (2 ** attempt) * (1 + random.random())
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+
+http_client = HttpClient()
@@ -0,0 +1,221 @@
+# utils/metrics.py
+import os
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+from aiohttp import web
+
+# Local Prometheus endpoint; 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Seconds; from in-memory lookups up to slow map downloads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LOOP_LAG_INTERVAL = 0.5
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> count
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def total(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Gauge(Counter):
+    """A value that goes up and down; with collect, it is computed on every scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, *label_values, value):
+        self.values[label_values] = value
+
+    def samples(self):
+        if self.collect is not None:
+            self.values = dict(self.collect())
+        return super().samples()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *label_values):
+        series = self.series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def quantile(self, share, *label_values):
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        series = self.series.get(label_values)
+        if not series:
+            return None
+        target = share * sum(series[:-1])
+        seen = 0
+        for bound, count in zip(self.buckets, series):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def mean(self, *label_values):
+        count = self.count(*label_values)
+        return self.series[label_values][-1] / count if count else None
+
+    def samples(self):
+        for label_values, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = format_labels(self.labels + ("le",), label_values + (bound,))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum", labels, series[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return {}  # not Linux
+    return {(): pages * os.sysconf("SC_PAGE_SIZE")}
+
+
+class Metrics:
+    """
+    In-process metrics, rendered in the Prometheus text format.
+
+    Updating a metric is a dict operation on the event loop thread, cheap
+    enough for the per-message path.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.stages = self.histogram("twbb_stage_seconds", "Time spent per pipeline stage.", ("stage",))
+        self.messages = self.counter("twbb_messages_total", "Messages seen by on_message, by outcome.", ("result",))
+        self.cache_requests = self.counter("twbb_cache_requests_total", "Cache lookups by cache and result.", ("cache", "result"))
+        self.http_requests = self.counter("twbb_http_requests_total", "Outgoing HTTP requests by status.", ("status",))
+        self.discord_rate_limits = self.counter("twbb_discord_rate_limited_total", "429 responses from the Discord API.")
+        self.loop_lag = self.gauge("twbb_event_loop_lag_seconds", "How late the event loop ran a scheduled callback.")
+        self.resident_memory = self.gauge("twbb_process_resident_bytes", "Resident memory of this process.",
+                                          collect=resident_memory)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), collect=None):
+        return self.register(Gauge(name, help, labels, collect))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    @contextmanager
+    def time(self, stage):
+        """Observe the duration of a block in twbb_stage_seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.observe(time.perf_counter() - started, stage)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class RateLimitCounter(logging.Handler):
+    """Count the 429s discord.py handles internally; it only reports them in its log."""
+
+    def emit(self, record):
+        message = record.getMessage()
+        # "... responded with 429 ..." (API) and "Webhook ID ... is rate limited" (webhooks)
+        if "429" in message or "is rate limited" in message:
+            metrics.discord_rate_limits.inc()
+
+
+def watch_discord_rate_limits():
+    handler = RateLimitCounter(logging.WARNING)
+    for name in ("discord.http", "discord.webhook.async_"):
+        logging.getLogger(name).addHandler(handler)
+
+
+async def monitor_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Keep twbb_event_loop_lag_seconds up to date by timing a periodic sleep."""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        metrics.loop_lag.set(value=max(0.0, loop.time() - expected))
+
+
+async def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics on a local port; returns the runner to clean up, or None when disabled."""
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        print(f"Error starting the metrics endpoint on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
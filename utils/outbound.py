@@ -0,0 +1,152 @@
+# utils/outbound.py
+import time
+import asyncio
+from collections import deque
+import discord
+from utils.metrics import metrics
+
+# Discord bulk-deletes at most 100 messages per request
+BULK_DELETE_MAX = 100
+# Retries of a repost that Discord answers with a 429 the library didn't absorb
+RATE_LIMIT_RETRIES = 3
+
+
+class Repost:
+    def __init__(self, message, calls):
+        self.message = message
+        self.calls = list(calls)  # webhook send kwargs not yet sent, in order
+        self.queued_at = time.perf_counter()
+
+
+class OutboundScheduler:
+    """
+    Ordered reposting of formatted messages through the channel webhooks.
+
+    Every channel gets a FIFO queue drained by one task, so reposts appear in
+    the order the originals were sent even while Discord makes the channel's
+    webhook bucket wait. Channels are drained in parallel, each as fast as
+    its own bucket allows. Originals are deleted only after their repost went
+    out, in bulk once a backlog builds up.
+    """
+
+    def __init__(self, webhook_manager):
+        self.webhook_manager = webhook_manager
+        self.queues = {}  # channel id -> deque of Repost
+        self.workers = {}  # channel id -> task draining the queue
+        self.bulk_delete_disabled = set()  # channels where bulk delete was refused
+        metrics.gauge("twbb_outbound_queue_depth", "Reposts waiting to be sent, over all channels.",
+                      collect=lambda: {(): sum(len(queue) for queue in self.queues.values())})
+        metrics.gauge("twbb_outbound_busy_channels", "Channels with reposts waiting.",
+                      collect=lambda: {(): len(self.workers)})
+        self.deletes = metrics.counter("twbb_outbound_deletes_total", "Original messages deleted, by method.", ("method",))
+        self.failures = metrics.counter("twbb_outbound_failures_total", "Reposts or deletes that failed, by step.", ("step",))
+
+    def submit(self, message, calls):
+        """
+        Queue a repost of message in its channel; the original is deleted once it is sent.
+
+        calls are the kwargs of the webhook sends making up the repost,
+        usually one; they go out back to back.
+        """
+        channel_id = message.channel.id
+        self.queues.setdefault(channel_id, deque()).append(Repost(message, calls))
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(self.drain(message.channel))
+
+    async def drain(self, channel):
+        queue = self.queues[channel.id]
+        sent = []
+        cancelled = False
+        try:
+            while queue:
+                repost = queue.popleft()
+                metrics.stages.observe(time.perf_counter() - repost.queued_at, "outbound_wait")
+                try:
+                    if await self.send(channel, repost):
+                        sent.append(repost.message)
+                    # Delete in one request what piled up, or when there is nothing left to send
+                    if len(sent) >= BULK_DELETE_MAX or not queue:
+                        try:
+                            await self.delete(channel, sent)
+                        finally:
+                            # Never delete the same originals twice
+                            sent = []
+                except Exception as e:
+                    # One bad repost must not strand the rest of the channel's queue
+                    self.failures.inc("unexpected")
+                    print(f"Error reposting message {repost.message.id} in channel {channel.id}: {e!r}")
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            del self.workers[channel.id]
+            if not queue:
+                del self.queues[channel.id]
+            elif not cancelled:
+                # Whatever ended this worker early, the queue still needs draining
+                self.workers[channel.id] = asyncio.create_task(self.drain(channel))
+            # Anything left after a cancellation is picked up by the next submit
+
+    async def send(self, channel, repost):
+        while repost.calls:
+            if not await self.send_call(channel, repost, repost.calls[0]):
+                return False
+            # A retry after a 429 resumes with the call that hit it
+            repost.calls.pop(0)
+        return True
+
+    async def send_call(self, channel, repost, kwargs):
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                with metrics.time("webhook_send"):
+                    await self.webhook_manager.send(channel, **kwargs)
+                return True
+            except discord.RateLimited as e:
+                retry_after = e.retry_after
+            except discord.HTTPException as e:
+                if e.status != 429 or attempt == RATE_LIMIT_RETRIES:
+                    self.failures.inc("send")
+                    print(f"Error reposting message {repost.message.id} in channel {channel.id}: {e}")
+                    return False
+                retry_after = float(e.response.headers.get("Retry-After", 1))
+            except Exception as e:
+                # Network errors, or anything else going wrong with this repost
+                self.failures.inc("send")
+                print(f"Error reposting message {repost.message.id} in channel {channel.id}: {e!r}")
+                return False
+            # Sleeping here holds back the rest of the channel's queue, keeping its order
+            await asyncio.sleep(retry_after)
+        self.failures.inc("send")
+        return False
+
+    async def delete(self, channel, messages):
+        if not messages:
+            return
+        with metrics.time("message_delete"):
+            if (len(messages) > 1 and hasattr(channel, "delete_messages")
+                    and channel.id not in self.bulk_delete_disabled):
+                try:
+                    await channel.delete_messages(messages)
+                    self.deletes.inc("bulk", amount=len(messages))
+                    return
+                except discord.Forbidden:
+                    # Missing permission for bulk delete here; stop trying it in this channel
+                    self.bulk_delete_disabled.add(channel.id)
+                except discord.HTTPException as e:
+                    # e.g. a message older than 14 days; fall back to single deletes
+                    print(f"Error bulk deleting in channel {channel.id}: {e}")
+
+            for message in messages:
+                try:
+                    await message.delete()
+                    self.deletes.inc("single")
+                except discord.NotFound:
+                    pass  # already deleted by its author
+                except discord.HTTPException as e:
+                    self.failures.inc("delete")
+                    print(f"Error deleting message {message.id} in channel {channel.id}: {e}")
+
+    async def join(self):
+        """Wait until every queued repost has been handled."""
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
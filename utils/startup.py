@@ -0,0 +1,43 @@
+# utils/startup.py
+import time
+import asyncio
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Records how long each startup phase took, measured from process start."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # phase name -> (seconds since start when finished, duration)
+
+    @contextmanager
+    def phase(self, name):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self.phases[name] = (now - self.started, now - phase_start)
+            print(f"Startup: {name} took {now - phase_start:.2f}s (t+{now - self.started:.2f}s)")
+
+    def mark(self, name):
+        """Record a point in time, such as the gateway becoming ready."""
+        now = time.perf_counter()
+        self.phases[name] = (now - self.started, 0.0)
+        print(f"Startup: {name} at t+{now - self.started:.2f}s")
+
+    async def run(self, name, coro):
+        with self.phase(name):
+            try:
+                return await coro
+            except Exception as e:
+                print(f"Startup: {name} failed: {e}")
+
+
+startup_timer = StartupTimer()
+
+
+async def warm_caches(*phases):
+    """Run named warm-up coroutines concurrently, timing each one."""
+    await asyncio.gather(*(startup_timer.run(name, coro) for name, coro in phases))
@@ -0,0 +1,106 @@
+# utils/webhooks.py
+import os
+import json
+import asyncio
+import discord
+from utils.metrics import metrics
+
+WEBHOOK_NAME = "Formatter Bot"
+WEBHOOKS_FILE = "webhooks.json"
+
+
+class WebhookManager:
+    """
+    One reusable "Formatter Bot" webhook per channel.
+
+    Webhooks are looked up (or created) the first time a channel needs one,
+    then kept in memory and in WEBHOOKS_FILE so restarts don't have to
+    create them again. A webhook deleted from the channel settings is
+    replaced on the next send. Threads have no webhooks of their own; they
+    share their parent channel's, which posts into them with thread=.
+    """
+
+    def __init__(self, client, path=WEBHOOKS_FILE):
+        self.client = client
+        self.path = path
+        self.webhooks = {}  # channel id -> discord.Webhook
+        self.saved = {}  # channel id -> {"id": ..., "token": ...}
+        self.locks = {}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                self.saved = json.load(f)
+        except (IOError, json.JSONDecodeError) as e:
+            print(f"Error loading webhooks: {e}")
+            self.saved = {}
+
+    def save(self):
+        try:
+            # Write to a temporary file first so a crash can't leave half a file behind
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.saved, f)
+            os.replace(tmp_path, self.path)
+        except IOError as e:
+            print(f"Error saving webhooks: {e}")
+
+    async def get_webhook(self, channel):
+        channel_id = str(channel.id)
+        webhook = self.webhooks.get(channel_id)
+        if webhook:
+            return webhook
+
+        lock = self.locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:
+            webhook = self.webhooks.get(channel_id)
+            if webhook:
+                return webhook
+
+            saved = self.saved.get(channel_id)
+            if saved:
+                webhook = discord.Webhook.partial(int(saved["id"]), saved["token"], client=self.client)
+            else:
+                with metrics.time("webhook_create"):
+                    webhook = await self.find_or_create(channel)
+                self.saved[channel_id] = {"id": str(webhook.id), "token": webhook.token}
+                self.save()
+            self.webhooks[channel_id] = webhook
+            return webhook
+
+    async def find_or_create(self, channel):
+        """Reuse the bot's existing webhook in the channel, or create one."""
+        for webhook in await channel.webhooks():
+            if webhook.name == WEBHOOK_NAME and webhook.token and webhook.user == self.client.user:
+                return webhook
+        return await channel.create_webhook(name=WEBHOOK_NAME)
+
+    def forget(self, channel):
+        channel_id = str(channel.id)
+        self.webhooks.pop(channel_id, None)
+        if self.saved.pop(channel_id, None) is not None:
+            self.save()
+
+    async def webhook_channel(self, channel):
+        """Return the channel owning the webhook: threads post through their parent's."""
+        if not isinstance(channel, discord.Thread):
+            return channel
+        if channel.parent is not None:
+            return channel.parent
+        return await self.client.fetch_channel(channel.parent_id)
+
+    async def send(self, channel, **kwargs):
+        """Send through the channel's webhook, replacing it once if it no longer exists."""
+        if isinstance(channel, discord.Thread):
+            kwargs["thread"] = channel
+        channel = await self.webhook_channel(channel)
+        webhook = await self.get_webhook(channel)
+        try:
+            return await webhook.send(**kwargs)
+        except discord.NotFound:
+            # The webhook was deleted outside the bot
+            self.forget(channel)
+            webhook = await self.get_webhook(channel)
+            return await webhook.send(**kwargs)